@@ -4,9 +4,12 @@ import jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+from cachetools import TTLCache
+import threading
 from models import User
-from database import get_db
+from database import get_ro_session_factory
 import os
 
 # Configuration
@@ -18,6 +21,13 @@ ACCESS_TOKEN_EXPIRE_DAYS = 7
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# Users resolved by recent requests, keyed by user id so every token a user
+# holds shares one entry; tokens are still verified on every request. No
+# route updates user rows, so nothing needs to evict entries before the TTL.
+USER_CACHE_TTL_SECONDS = 30
+_user_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL_SECONDS)
+_user_cache_lock = threading.Lock()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -49,22 +59,32 @@ def verify_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-async def get_current_user(
+def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    session_factory: sessionmaker = Depends(get_ro_session_factory)
 ) -> User:
     """Get current authenticated user"""
-    token = credentials.credentials
-    payload = verify_token(token)
+    payload = verify_token(credentials.credentials)
     user_id = payload.get("user_id")
     
-    user = db.query(User).filter(User.id == user_id).first()
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    # Look the user up on a session closed before returning, so a request
+    # never holds this connection alongside the route's own
+    with session_factory() as db:
+        user = db.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    
+    with _user_cache_lock:
+        _user_cache[user_id] = user
     return user
 
 def get_user_id_from_token(token: str) -> str:
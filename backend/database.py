@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
 import os
@@ -7,25 +7,93 @@ from models import Base
 # Use SQLite for simplicity as requested
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./aeonpay.db")
 
+# File-backed SQLite gets a real connection pool plus WAL journaling
+SQLITE_FILE_DB = DATABASE_URL.startswith("sqlite") and ":memory:" not in DATABASE_URL
+
+# Connection pool sizing
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 10))
+POOL_MAX_OVERFLOW = int(os.getenv("SQLITE_POOL_MAX_OVERFLOW", 20))
+
 # Configure SQLite with proper settings
-if DATABASE_URL.startswith("sqlite"):
+if SQLITE_FILE_DB:
     engine = create_engine(
         DATABASE_URL,
         connect_args={
             "check_same_thread": False,
             "timeout": 20
         },
-        poolclass=StaticPool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_pre_ping=True,
         echo=False  # Set to True for SQL debugging
     )
+elif DATABASE_URL.startswith("sqlite"):
+    # In-memory databases only exist on a single shared connection
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": 20
+        },
+        poolclass=StaticPool,
+        echo=False
+    )
 else:
     engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if SQLITE_FILE_DB:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Enable WAL so readers don't block behind the writer, and fsync less per commit"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+# Objects keep their loaded state after commit so handlers can build
+# responses without re-reading rows they just wrote
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+# Sessions for GET routes; on file-backed SQLite their connection is put
+# in query_only mode so a read can never take the write lock
+ReadOnlySessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+if SQLITE_FILE_DB:
+    @event.listens_for(ReadOnlySessionLocal, "after_begin")
+    def set_query_only(session, transaction, connection):
+        connection.exec_driver_sql("PRAGMA query_only=ON")
+        connection.info["query_only"] = True
+
+    @event.listens_for(engine, "checkin")
+    def reset_query_only(dbapi_connection, connection_record):
+        if dbapi_connection is not None and connection_record.info.pop("query_only", False):
+            dbapi_connection.execute("PRAGMA query_only=OFF")
+
+# Set once the schema has been created through this engine
+_tables_created = False
 
 def create_tables():
-    """Create all database tables"""
+    """Create all database tables (once per process)"""
+    global _tables_created
+    if _tables_created:
+        return
     Base.metadata.create_all(bind=engine)
+    _tables_created = True
+
+def optimize_database():
+    """Refresh SQLite query planner statistics"""
+    if not SQLITE_FILE_DB:
+        return
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
 
 def get_db() -> Session:
     """Dependency to get database session"""
@@ -35,6 +103,19 @@ def get_db() -> Session:
     finally:
         db.close()
 
+def get_ro_db() -> Session:
+    """Dependency to get a read-only database session"""
+    db = ReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_ro_session_factory() -> sessionmaker:
+    """Dependency to get the read-only session factory, for lookups that
+    must release their connection before the route opens its own"""
+    return ReadOnlySessionLocal
+
 def get_db_session() -> Session:
     """Get database session for non-FastAPI code"""
     return SessionLocal()
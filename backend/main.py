@@ -1,31 +1,59 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import os
 
-from database import create_tables, get_db
+from database import create_tables, get_db, optimize_database
 from routes import auth, plans, vouchers, mandates, payments, merchants, users
-from services.idempotency import IdempotencyService
+from routes.merchants import clear_merchant_cache
+from services.idempotency import idempotency_service
 from seed_data import seed_database
 
-# Global idempotency service
-idempotency_service = IdempotencyService()
+# How often to run periodic database maintenance (seconds)
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", 900))
+
+async def run_db_maintenance():
+    """Periodically purge expired idempotency keys and run PRAGMA optimize off the event loop"""
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(idempotency_service.purge_expired)
+            await asyncio.to_thread(optimize_database)
+        except Exception as e:
+            print(f"Database maintenance failed: {e}")
+
+async def run_seed():
+    """Seed the database without holding up startup"""
+    try:
+        await asyncio.to_thread(seed_database)
+    except Exception as e:
+        print(f"Database seeding failed: {e}")
+    finally:
+        # Listings cached while seeding was in progress may be incomplete
+        clear_merchant_cache()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     create_tables()
-    seed_database()
+    seed_task = asyncio.create_task(run_seed())
+    maintenance_task = asyncio.create_task(run_db_maintenance())
     yield
-    # Shutdown - cleanup if needed
+    # Shutdown
+    seed_task.cancel()
+    maintenance_task.cancel()
 
 app = FastAPI(
     title="AeonPay API",
     description="Smart group payments API with vouchers, mandates, and guardrails",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -43,7 +71,9 @@ async def idempotency_middleware(request: Request, call_next):
     idempotency_key = request.headers.get("idempotency-key")
     
     if idempotency_key and request.method in ["POST", "PUT", "PATCH"]:
-        existing_response = idempotency_service.get_response(idempotency_key)
+        existing_response = await run_in_threadpool(
+            idempotency_service.get_response, idempotency_key
+        )
         if existing_response:
             return existing_response
             
@@ -1,14 +1,51 @@
-from sqlalchemy import Column, String, Decimal, DateTime, Text, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, String, BigInteger, DateTime, Text, Boolean, ForeignKey, JSON, Index, event
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
-from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, validator
-from decimal import Decimal as PyDecimal
+from typing import Optional, List, Dict, Any, Annotated
+from pydantic import BaseModel, ConfigDict, AfterValidator, TypeAdapter, validator
+from decimal import Decimal as PyDecimal, ROUND_HALF_UP
 
 Base = declarative_base()
 
+class Money(TypeDecorator):
+    """Monetary amount stored as integer paise, exposed as a 2dp Decimal"""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, PyDecimal):
+            value = PyDecimal(str(value))
+        return int(value.scaleb(2).quantize(PyDecimal(1), rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return PyDecimal(int(value)).scaleb(-2)
+
+
+def quantize_money(value: PyDecimal) -> PyDecimal:
+    """Normalise to exactly 2 places; sub-paise amounts are rejected, not rounded"""
+    quantized = value.quantize(PyDecimal("0.01"), rounding=ROUND_HALF_UP)
+    if quantized != value:
+        raise ValueError("amount must have at most 2 decimal places")
+    return quantized
+
+# Request amounts in the shape the Money column returns them, so a create
+# response (and its idempotent replay) matches what later reads return
+MoneyAmount = Annotated[PyDecimal, AfterValidator(quantize_money)]
+
+_money_adapter = TypeAdapter(MoneyAmount)
+
+def parse_money(value: Any) -> PyDecimal:
+    """Validate an amount from an untyped request body (raises ValueError)"""
+    return _money_adapter.validate_python(value)
+
+
 # SQLAlchemy Models
 class User(Base):
     __tablename__ = "users"
@@ -41,8 +78,8 @@ class Merchant(Base):
     
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
-    category = Column(String, nullable=False)
-    campus_id = Column(String, ForeignKey("campuses.id"))
+    category = Column(String, nullable=False, index=True)
+    campus_id = Column(String, ForeignKey("campuses.id"), index=True)
     icon = Column(String, nullable=True)
     location = Column(String, nullable=True)
     
@@ -55,7 +92,7 @@ class Plan(Base):
     
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
-    cap_per_head = Column(Decimal(10, 2), nullable=False)
+    cap_per_head = Column(Money, nullable=False)
     window_start = Column(DateTime, nullable=False)
     window_end = Column(DateTime, nullable=False)
     merchant_whitelist = Column(JSON, default=list)
@@ -63,6 +100,10 @@ class Plan(Base):
     created_by = Column(String, ForeignKey("users.id"))
     created_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index("ix_plans_created_by", "created_by"),
+    )
+    
     # Relationships
     creator = relationship("User", back_populates="created_plans")
     members = relationship("PlanMember", back_populates="plan")
@@ -74,11 +115,15 @@ class PlanMember(Base):
     __tablename__ = "plan_members"
     
     id = Column(String, primary_key=True)
-    plan_id = Column(String, ForeignKey("plans.id"))
+    plan_id = Column(String, ForeignKey("plans.id"), index=True)
     user_id = Column(String, ForeignKey("users.id"))
     state = Column(String, default="active")  # active, left, removed
     joined_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index("ix_plan_members_user_state", "user_id", "state"),
+    )
+    
     # Relationships
     plan = relationship("Plan", back_populates="members")
     user = relationship("User", back_populates="plan_memberships")
@@ -87,9 +132,9 @@ class Voucher(Base):
     __tablename__ = "vouchers"
     
     id = Column(String, primary_key=True)
-    plan_id = Column(String, ForeignKey("plans.id"))
-    member_user_id = Column(String, ForeignKey("users.id"))
-    amount = Column(Decimal(10, 2), nullable=False)
+    plan_id = Column(String, ForeignKey("plans.id"), index=True)
+    member_user_id = Column(String, ForeignKey("users.id"), index=True)
+    amount = Column(Money, nullable=False)
     merchant_list = Column(JSON, default=list)
     expires_at = Column(DateTime, nullable=False)
     state = Column(String, default="active")  # active, redeemed, expired
@@ -104,9 +149,9 @@ class Mandate(Base):
     __tablename__ = "mandates"
     
     id = Column(String, primary_key=True)
-    plan_id = Column(String, ForeignKey("plans.id"))
-    member_user_id = Column(String, ForeignKey("users.id"))
-    cap_amount = Column(Decimal(10, 2), nullable=False)
+    plan_id = Column(String, ForeignKey("plans.id"), index=True)
+    member_user_id = Column(String, ForeignKey("users.id"), index=True)
+    cap_amount = Column(Money, nullable=False)
     valid_from = Column(DateTime, nullable=False)
     valid_to = Column(DateTime, nullable=False)
     state = Column(String, default="active")  # active, expired, cancelled
@@ -122,7 +167,7 @@ class VoucherRedemption(Base):
     
     id = Column(String, primary_key=True)
     voucher_id = Column(String, ForeignKey("vouchers.id"))
-    amount = Column(Decimal(10, 2), nullable=False)
+    amount = Column(Money, nullable=False)
     merchant_id = Column(String, ForeignKey("merchants.id"))
     transaction_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
@@ -135,7 +180,7 @@ class MandateExecution(Base):
     
     id = Column(String, primary_key=True)
     mandate_id = Column(String, ForeignKey("mandates.id"))
-    amount = Column(Decimal(10, 2), nullable=False)
+    amount = Column(Money, nullable=False)
     merchant_id = Column(String, ForeignKey("merchants.id"))
     transaction_id = Column(String, nullable=True)
     status = Column(String, nullable=False)  # success, failed
@@ -151,12 +196,16 @@ class Transaction(Base):
     intent_id = Column(String, unique=True, nullable=False)
     plan_id = Column(String, ForeignKey("plans.id"))
     merchant_id = Column(String, ForeignKey("merchants.id"))
-    amount = Column(Decimal(10, 2), nullable=False)
+    amount = Column(Money, nullable=False)
     mode = Column(String, nullable=False)  # vouchers, mandates, split_later
     status = Column(String, default="pending")  # pending, completed, failed
     rrn_stub = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index("ix_tx_plan_created", "plan_id", "created_at"),
+    )
+    
     # Relationships
     plan = relationship("Plan", back_populates="transactions")
     merchant = relationship("Merchant", back_populates="transactions")
@@ -166,22 +215,71 @@ class LedgerEntry(Base):
     __tablename__ = "ledger_entries"
     
     id = Column(String, primary_key=True)
-    txn_id = Column(String, ForeignKey("transactions.id"))
+    txn_id = Column(String, ForeignKey("transactions.id"), index=True)
     account = Column(String, nullable=False)
     leg = Column(String, nullable=False)  # debit, credit
-    amount = Column(Decimal(10, 2), nullable=False)
+    amount = Column(Money, nullable=False)
     created_at = Column(DateTime, default=func.now())
     
+    # Covers per-account balance sums without touching the table
+    __table_args__ = (
+        Index("ix_ledger_account_leg", "account", "leg", "amount"),
+    )
+    
     # Relationships
     transaction = relationship("Transaction", back_populates="ledger_entries")
 
+class AccountBalance(Base):
+    __tablename__ = "account_balances"
+    
+    account = Column(String, primary_key=True)
+    balance = Column(Money, nullable=False, default=0)  # credits - debits
+
+# Keep account_balances in step with every ledger insert so balance reads
+# are a primary-key lookup instead of a SUM over the account's history
+ACCOUNT_BALANCE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS trg_ledger_entries_account_balance
+AFTER INSERT ON ledger_entries
+BEGIN
+    INSERT INTO account_balances (account, balance)
+    VALUES (NEW.account, CASE NEW.leg WHEN 'credit' THEN NEW.amount ELSE -NEW.amount END)
+    ON CONFLICT (account) DO UPDATE SET balance = balance + excluded.balance;
+END
+"""
+
+ACCOUNT_BALANCE_BACKFILL = """
+INSERT INTO account_balances (account, balance)
+SELECT account, SUM(CASE leg WHEN 'credit' THEN amount ELSE -amount END)
+FROM ledger_entries
+GROUP BY account
+"""
+
+@event.listens_for(Base.metadata, "after_create")
+def create_account_balance_trigger(target, connection, tables=(), **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    if AccountBalance.__table__ in tables:
+        connection.exec_driver_sql(ACCOUNT_BALANCE_BACKFILL)
+    elif not connection.dialect.has_table(connection, AccountBalance.__tablename__):
+        # The trigger writes to account_balances; without it every ledger
+        # insert would fail
+        return
+    connection.exec_driver_sql(ACCOUNT_BALANCE_TRIGGER)
+
 class IdempotentRequest(Base):
     __tablename__ = "idempotent_requests"
     
     id = Column(String, primary_key=True)
     idempotency_key = Column(String, unique=True, nullable=False)
     response_data = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=func.now(), index=True)
+
+class AppMetadata(Base):
+    __tablename__ = "app_metadata"
+    
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=func.now())
 
 # Pydantic Models for API
 class UserBase(BaseModel):
@@ -197,12 +295,11 @@ class UserResponse(UserBase):
     id: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PlanBase(BaseModel):
     name: str
-    cap_per_head: PyDecimal
+    cap_per_head: MoneyAmount
     window_start: datetime
     window_end: datetime
     merchant_whitelist: List[str] = []
@@ -216,13 +313,12 @@ class PlanResponse(PlanBase):
     created_by: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class VoucherBase(BaseModel):
     plan_id: str
     member_user_ids: List[str]
-    amount: PyDecimal
+    amount: MoneyAmount
     merchant_list: List[str] = []
     expires_at: datetime
 
@@ -239,13 +335,12 @@ class VoucherResponse(BaseModel):
     state: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class MandateBase(BaseModel):
     plan_id: str
     member_user_ids: List[str]
-    cap_amount: PyDecimal
+    cap_amount: MoneyAmount
     valid_from: datetime
     valid_to: datetime
 
@@ -262,11 +357,10 @@ class MandateResponse(BaseModel):
     state: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PaymentIntentCreate(BaseModel):
-    amount: PyDecimal
+    amount: MoneyAmount
     merchant_id: str
     plan_id: str
     mode: str  # vouchers, mandates, split_later
@@ -287,8 +381,7 @@ class TransactionResponse(BaseModel):
     rrn_stub: Optional[str]
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class MerchantResponse(BaseModel):
     id: str
@@ -298,8 +391,7 @@ class MerchantResponse(BaseModel):
     icon: Optional[str]
     location: Optional[str]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class LoginRequest(BaseModel):
     phone: str
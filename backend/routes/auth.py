@@ -2,14 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, Request
 from sqlalchemy.orm import Session
 from models import User, LoginRequest, LoginResponse, UserCreate, UserResponse
 from database import get_db
-from auth import create_access_token
+from auth import create_access_token, get_current_user
 from services.idempotency import store_idempotent_response
-import uuid
+from services.ids import new_id
 
 router = APIRouter()
 
 @router.post("/mock_login", response_model=LoginResponse)
-async def mock_login(
+def mock_login(
     request: Request,
     login_data: LoginRequest,
     db: Session = Depends(get_db)
@@ -28,7 +28,7 @@ async def mock_login(
         )
         
         user = User(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             phone=user_data.phone,
             name=user_data.name,
             email=user_data.email,
@@ -44,18 +44,18 @@ async def mock_login(
     
     response_data = LoginResponse(
         token=token,
-        user=UserResponse.from_orm(user)
+        user=UserResponse.model_validate(user)
     )
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data.dict())
+        store_idempotent_response(db, request.state.idempotency_key, response_data.model_dump(mode="json"))
     
     return response_data
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(
+def get_current_user_info(
     current_user: User = Depends(get_current_user)
 ):
     """Get current user information"""
-    return UserResponse.from_orm(current_user)
+    return UserResponse.model_validate(current_user)
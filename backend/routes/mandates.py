@@ -1,19 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import update, case, exists
 from sqlalchemy.orm import Session
 from typing import List
 from models import (
-    Mandate, MandateExecution, Plan, User,
-    MandateCreate, MandateResponse
+    Mandate, MandateExecution, Plan, Merchant, User,
+    MandateCreate, MandateResponse, parse_money
 )
-from database import get_db
+from database import get_db, get_ro_db
 from auth import get_current_user
 from services.idempotency import store_idempotent_response
-import uuid
+from services.ids import new_id
+from datetime import datetime
 
 router = APIRouter()
 
 @router.post("/create", response_model=dict)
-async def create_mandates(
+def create_mandates(
     request: Request,
     mandate_data: MandateCreate,
     db: Session = Depends(get_db),
@@ -29,45 +32,45 @@ async def create_mandates(
     if plan.created_by != current_user.id:
         raise HTTPException(status_code=403, detail="Only plan creator can create mandates")
     
-    # Create mandates for each member
-    mandates = []
-    for member_id in mandate_data.member_user_ids:
-        # Verify user exists
-        user = db.query(User).filter(User.id == member_id).first()
-        if not user:
-            continue
-            
-        mandate = Mandate(
-            id=str(uuid.uuid4()),
+    # Verify member users exist with a single query
+    existing_user_ids = {
+        user_id for (user_id,) in
+        db.query(User.id).filter(User.id.in_(mandate_data.member_user_ids)).all()
+    }
+    
+    # Create mandates for each member; created_at is set here so the
+    # response can be built without re-reading the rows
+    now = datetime.utcnow()
+    mandates = [
+        Mandate(
+            id=new_id(),
             plan_id=mandate_data.plan_id,
             member_user_id=member_id,
             cap_amount=mandate_data.cap_amount,
             valid_from=mandate_data.valid_from,
             valid_to=mandate_data.valid_to,
-            state="active"
+            state="active",
+            created_at=now
         )
-        
-        db.add(mandate)
-        mandates.append(mandate)
+        for member_id in mandate_data.member_user_ids
+        if member_id in existing_user_ids
+    ]
     
+    db.add_all(mandates)
     db.commit()
     
-    # Refresh to get created_at timestamps
-    for mandate in mandates:
-        db.refresh(mandate)
-    
     response_data = {
-        "mandates": [MandateResponse.from_orm(m).dict() for m in mandates]
+        "mandates": [MandateResponse.model_validate(m).model_dump(mode="json") for m in mandates]
     }
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.post("/execute", response_model=dict)
-async def execute_mandate(
+def execute_mandate(
     request: Request,
     execution_data: dict,
     db: Session = Depends(get_db),
@@ -77,43 +80,64 @@ async def execute_mandate(
     
     mandate_id = execution_data.get("mandate_id")
     amount = execution_data.get("amount")
+    merchant_id = execution_data.get("merchant_id")
     
     if not mandate_id or not amount:
         raise HTTPException(status_code=400, detail="Mandate ID and amount required")
     
-    # Find mandate
-    mandate = db.query(Mandate).filter(
-        Mandate.id == mandate_id,
-        Mandate.state == "active"
-    ).first()
-    
-    if not mandate:
-        raise HTTPException(status_code=404, detail="Mandate not found or inactive")
-    
-    # Check if amount exceeds cap
-    if amount > mandate.cap_amount:
+    # Validate up front so the stored and reported amounts are the same
+    try:
+        amount = parse_money(amount)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Amount must be a number with at most 2 decimal places")
+    
+    # The execution row references the merchant by foreign key; check it
+    # before the cap is debited
+    if merchant_id is not None and not db.query(
+        exists().where(Merchant.id == merchant_id)
+    ).scalar():
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    
+    # Debit the mandate in a single guarded UPDATE so concurrent executions
+    # against the same mandate cannot both spend the same cap
+    remaining_cap = db.execute(
+        update(Mandate)
+        .where(
+            Mandate.id == mandate_id,
+            Mandate.state == "active",
+            Mandate.cap_amount >= amount
+        )
+        .values(
+            cap_amount=Mandate.cap_amount - amount,
+            state=case(
+                (Mandate.cap_amount - amount <= 0, "expired"),
+                else_=Mandate.state
+            )
+        )
+        .returning(Mandate.cap_amount)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    
+    if remaining_cap is None:
+        mandate_active = db.query(
+            db.query(Mandate).filter(
+                Mandate.id == mandate_id,
+                Mandate.state == "active"
+            ).exists()
+        ).scalar()
+        if not mandate_active:
+            raise HTTPException(status_code=404, detail="Mandate not found or inactive")
         raise HTTPException(status_code=400, detail="Amount exceeds mandate cap")
     
-    # Dev-mock: randomly succeed or fail for demonstration
-    import random
-    success = random.choice([True, True, True, False])  # 75% success rate
-    
     # Create execution record
     execution = MandateExecution(
-        id=str(uuid.uuid4()),
+        id=new_id(),
         mandate_id=mandate_id,
         amount=amount,
-        merchant_id=execution_data.get("merchant_id"),
-        status="success" if success else "failed"
+        merchant_id=merchant_id,
+        status="success"
     )
     db.add(execution)
-    
-    # Update mandate if successful
-    if success:
-        mandate.cap_amount -= amount
-        if mandate.cap_amount <= 0:
-            mandate.state = "expired"
-    
     db.commit()
     
     response_data = {
@@ -121,21 +145,21 @@ async def execute_mandate(
             "mandate_id": mandate_id,
             "amount": float(amount),
             "status": execution.status,
-            "remaining_cap": float(mandate.cap_amount),
+            "remaining_cap": float(remaining_cap),
             "execution_id": execution.id
         }
     }
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.get("/plan/{plan_id}", response_model=List[MandateResponse])
-async def get_plan_mandates(
+def get_plan_mandates(
     plan_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get all mandates for a plan"""
@@ -145,5 +169,13 @@ async def get_plan_mandates(
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    mandates = db.query(Mandate).filter(Mandate.plan_id == plan_id).all()
-    return [MandateResponse.from_orm(m) for m in mandates]
+    # Rows come straight from the DB; returning a response directly keeps
+    # response_model (used for the docs) from validating them again
+    mandates = db.query(
+        Mandate.id, Mandate.plan_id, Mandate.member_user_id, Mandate.cap_amount,
+        Mandate.valid_from, Mandate.valid_to, Mandate.state, Mandate.created_at
+    ).filter(Mandate.plan_id == plan_id).all()
+    return ORJSONResponse(content=[
+        MandateResponse.model_construct(**row._mapping).model_dump(mode="json")
+        for row in mandates
+    ])
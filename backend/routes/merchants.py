@@ -1,20 +1,49 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from cachetools import TTLCache
+import threading
 from models import Merchant, MerchantResponse
-from database import get_db
+from database import get_ro_db
 
 router = APIRouter()
 
+# Merchant data rarely changes, so listings are cached in-process
+MERCHANTS_CACHE_TTL = 300
+CATEGORIES_CACHE_TTL = 600
+
+_merchants_cache = TTLCache(maxsize=256, ttl=MERCHANTS_CACHE_TTL)
+_categories_cache = TTLCache(maxsize=1, ttl=CATEGORIES_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+def clear_merchant_cache():
+    """Drop cached merchant listings (call after merchant data changes)"""
+    with _cache_lock:
+        _merchants_cache.clear()
+        _categories_cache.clear()
+
 @router.get("/", response_model=List[MerchantResponse])
-async def get_merchants(
+def get_merchants(
     campus_id: Optional[str] = Query(None, description="Filter by campus ID"),
     category: Optional[str] = Query(None, description="Filter by category"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_ro_db)
 ):
     """Get merchants with optional filtering"""
     
-    query = db.query(Merchant)
+    cache_key = (campus_id, category)
+    with _cache_lock:
+        cached = _merchants_cache.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(content=cached)
+    
+    # Select plain columns and skip validation; rows come straight from the DB.
+    # Returning a response directly keeps response_model (used for the docs)
+    # from validating them again.
+    query = db.query(
+        Merchant.id, Merchant.name, Merchant.category,
+        Merchant.campus_id, Merchant.icon, Merchant.location
+    )
     
     if campus_id:
         query = query.filter(Merchant.campus_id == campus_id)
@@ -22,13 +51,19 @@ async def get_merchants(
     if category:
         query = query.filter(Merchant.category == category)
     
-    merchants = query.all()
-    return [MerchantResponse.from_orm(m) for m in merchants]
+    result = [
+        MerchantResponse.model_construct(**row._mapping).model_dump(mode="json")
+        for row in query.all()
+    ]
+    
+    with _cache_lock:
+        _merchants_cache[cache_key] = result
+    return ORJSONResponse(content=result)
 
 @router.get("/{merchant_id}", response_model=MerchantResponse)
-async def get_merchant(
+def get_merchant(
     merchant_id: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_ro_db)
 ):
     """Get merchant by ID"""
     
@@ -36,11 +71,20 @@ async def get_merchant(
     if not merchant:
         raise HTTPException(status_code=404, detail="Merchant not found")
     
-    return MerchantResponse.from_orm(merchant)
+    return MerchantResponse.model_validate(merchant)
 
 @router.get("/categories/list", response_model=List[str])
-async def get_merchant_categories(db: Session = Depends(get_db)):
+def get_merchant_categories(db: Session = Depends(get_ro_db)):
     """Get all unique merchant categories"""
     
+    with _cache_lock:
+        cached = _categories_cache.get("all")
+    if cached is not None:
+        return cached
+    
     categories = db.query(Merchant.category).distinct().all()
-    return [category[0] for category in categories]
+    result = [category[0] for category in categories]
+    
+    with _cache_lock:
+        _categories_cache["all"] = result
+    return result
@@ -1,21 +1,26 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from sqlalchemy import select, exists
 from sqlalchemy.orm import Session
 from models import (
-    Transaction, Plan, Merchant, User,
+    Transaction, Plan, PlanMember, Merchant, User,
     PaymentIntentCreate, PaymentConfirm, TransactionResponse
 )
-from database import get_db
+from database import get_db, get_ro_db
 from auth import get_current_user
 from services.idempotency import store_idempotent_response
 from services.ledger import create_ledger_entries
+from routes.users import invalidate_user_stats
+from datetime import datetime
+from decimal import Decimal
 import uuid
-import time
-import random
+from services.ids import new_id
 
 router = APIRouter()
 
+GUARDRAIL_THRESHOLD = Decimal("250")
+
 @router.post("/intent", response_model=dict)
-async def create_payment_intent(
+def create_payment_intent(
     request: Request,
     intent_data: PaymentIntentCreate,
     db: Session = Depends(get_db),
@@ -23,51 +28,54 @@ async def create_payment_intent(
 ):
     """Create payment intent"""
     
-    # Verify plan and merchant exist
-    plan = db.query(Plan).filter(Plan.id == intent_data.plan_id).first()
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan not found")
+    # Check for guardrail (simple threshold for demo)
+    # In production, this would check against actual plan balances/caps
+    guardrail_required = intent_data.amount > GUARDRAIL_THRESHOLD
     
-    merchant = db.query(Merchant).filter(Merchant.id == intent_data.merchant_id).first()
-    if not merchant:
+    # Verify plan and merchant exist in one round-trip
+    plan_exists, merchant_exists = db.execute(
+        select(
+            exists().where(Plan.id == intent_data.plan_id),
+            exists().where(Merchant.id == intent_data.merchant_id)
+        )
+    ).one()
+    if not plan_exists:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    if not merchant_exists:
         raise HTTPException(status_code=404, detail="Merchant not found")
     
     # Generate unique intent ID
-    intent_id = f"intent_{int(time.time())}_{random.randint(1000, 9999)}"
+    intent_id = f"intent_{uuid.uuid4().hex}"
     
     # Create transaction record
     transaction = Transaction(
-        id=str(uuid.uuid4()),
+        id=new_id(),
         intent_id=intent_id,
         plan_id=intent_data.plan_id,
         merchant_id=intent_data.merchant_id,
         amount=intent_data.amount,
         mode=intent_data.mode,
-        status="pending"
+        status="pending",
+        created_at=datetime.utcnow()
     )
     
     db.add(transaction)
     db.commit()
-    db.refresh(transaction)
-    
-    # Check for guardrail (simple threshold for demo)
-    # In production, this would check against actual plan balances/caps
-    guardrail_required = float(intent_data.amount) > 250.0
     
     response_data = {
         "intent_id": intent_id,
-        "transaction": TransactionResponse.from_orm(transaction).dict(),
+        "transaction": TransactionResponse.model_validate(transaction).model_dump(mode="json"),
         "guardrail_required": guardrail_required
     }
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.post("/confirm", response_model=dict)
-async def confirm_payment(
+def confirm_payment(
     request: Request,
     confirm_data: PaymentConfirm,
     db: Session = Depends(get_db),
@@ -75,31 +83,34 @@ async def confirm_payment(
 ):
     """Confirm payment and update transaction"""
     
-    # Find transaction by intent ID
-    transaction = db.query(Transaction).filter(
-        Transaction.intent_id == confirm_data.intent_id,
-        Transaction.status == "pending"
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found or already processed")
-    
-    # Update transaction
-    transaction.status = confirm_data.status
-    transaction.rrn_stub = confirm_data.rrn_stub
-    
-    # Create ledger entries for successful transactions
+    # Status change and both ledger legs commit together
+    with db.begin():
+        # Find transaction by intent ID
+        transaction = db.query(Transaction).filter(
+            Transaction.intent_id == confirm_data.intent_id,
+            Transaction.status == "pending"
+        ).first()
+        
+        if not transaction:
+            raise HTTPException(status_code=404, detail="Transaction not found or already processed")
+        
+        # Update transaction
+        transaction.status = confirm_data.status
+        transaction.rrn_stub = confirm_data.rrn_stub
+        
+        # Create ledger entries for successful transactions
+        if confirm_data.status == "completed":
+            create_ledger_entries(
+                db=db,
+                transaction_id=transaction.id,
+                amount=transaction.amount,
+                account_debit=f"plan_{transaction.plan_id}",
+                account_credit=f"merchant_{transaction.merchant_id}"
+            )
+    
+    # Completed payments change transaction totals for every plan member
     if confirm_data.status == "completed":
-        create_ledger_entries(
-            db=db,
-            transaction_id=transaction.id,
-            amount=transaction.amount,
-            account_debit=f"plan_{transaction.plan_id}",
-            account_credit=f"merchant_{transaction.merchant_id}"
-        )
-    
-    db.commit()
-    db.refresh(transaction)
+        invalidate_user_stats()
     
     response_data = {
         "transaction_id": transaction.id,
@@ -109,27 +120,31 @@ async def confirm_payment(
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.get("/transactions", response_model=list)
-async def get_user_transactions(
-    db: Session = Depends(get_db),
+def get_user_transactions(
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get user's transaction history"""
     
     # Get transactions from plans where user is creator or member
-    from models import PlanMember
-    
-    member_plan_ids = db.query(PlanMember.plan_id).filter(
-        PlanMember.user_id == current_user.id,
-        PlanMember.state == "active"
-    ).subquery()
-    
-    transactions = db.query(Transaction).filter(
-        Transaction.plan_id.in_(member_plan_ids)
+    transactions = db.query(
+        Transaction.id, Transaction.intent_id, Transaction.plan_id,
+        Transaction.merchant_id, Transaction.amount, Transaction.mode,
+        Transaction.status, Transaction.rrn_stub, Transaction.created_at
+    ).filter(
+        # Semi-join: a transaction is listed once however many membership
+        # rows the user has in its plan
+        Transaction.plan_id.in_(
+            select(PlanMember.plan_id).where(
+                PlanMember.user_id == current_user.id,
+                PlanMember.state == "active"
+            )
+        )
     ).order_by(Transaction.created_at.desc()).limit(50).all()
     
-    return [TransactionResponse.from_orm(t).dict() for t in transactions]
+    return [TransactionResponse.model_construct(**row._mapping).model_dump(mode="json") for row in transactions]
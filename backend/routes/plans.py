@@ -5,15 +5,17 @@ from models import (
     Plan, PlanMember, User, 
     PlanCreate, PlanResponse
 )
-from database import get_db
+from database import get_db, get_ro_db
 from auth import get_current_user
 from services.idempotency import store_idempotent_response
-import uuid
+from routes.users import invalidate_user_stats
+from services.ids import new_id
+from datetime import datetime
 
 router = APIRouter()
 
 @router.post("/", response_model=dict)
-async def create_plan(
+def create_plan(
     request: Request,
     plan_data: PlanCreate,
     db: Session = Depends(get_db),
@@ -21,65 +23,67 @@ async def create_plan(
 ):
     """Create a new plan with members"""
     
-    # Create plan
-    plan = Plan(
-        id=str(uuid.uuid4()),
-        name=plan_data.name,
-        cap_per_head=plan_data.cap_per_head,
-        window_start=plan_data.window_start,
-        window_end=plan_data.window_end,
-        merchant_whitelist=plan_data.merchant_whitelist,
-        status="active",
-        created_by=current_user.id
-    )
-    
-    db.add(plan)
-    db.flush()  # Get the ID without committing
-    
-    # Add plan members
-    members = []
-    for member_id in plan_data.member_ids:
-        # Verify user exists
-        user = db.query(User).filter(User.id == member_id).first()
-        if user:
-            member = PlanMember(
-                id=str(uuid.uuid4()),
-                plan_id=plan.id,
-                user_id=member_id,
-                state="active"
-            )
-            db.add(member)
-            members.append(member_id)
-    
-    # Add creator as member if not already included
-    if current_user.id not in plan_data.member_ids:
-        creator_member = PlanMember(
-            id=str(uuid.uuid4()),
-            plan_id=plan.id,
-            user_id=current_user.id,
-            state="active"
+    # Plan and members are written in one transaction (one commit, one fsync)
+    with db.begin():
+        plan = Plan(
+            id=new_id(),
+            name=plan_data.name,
+            cap_per_head=plan_data.cap_per_head,
+            window_start=plan_data.window_start,
+            window_end=plan_data.window_end,
+            merchant_whitelist=plan_data.merchant_whitelist,
+            status="active",
+            created_by=current_user.id,
+            created_at=datetime.utcnow()
         )
-        db.add(creator_member)
-        members.append(current_user.id)
+        
+        db.add(plan)
+        db.flush()  # Insert the plan before its members reference it
+        
+        # Verify member users exist with a single query; a user listed
+        # twice still gets one membership row
+        member_ids = list(dict.fromkeys(plan_data.member_ids))
+        existing_user_ids = {
+            user_id for (user_id,) in
+            db.query(User.id).filter(User.id.in_(member_ids)).all()
+        }
+        members = [
+            member_id for member_id in member_ids
+            if member_id in existing_user_ids
+        ]
+        
+        # Add creator as member if not already included
+        if current_user.id not in member_ids:
+            members.append(current_user.id)
+        
+        # Add plan members with a single executemany INSERT
+        db.bulk_insert_mappings(PlanMember, [
+            {
+                "id": new_id(),
+                "plan_id": plan.id,
+                "user_id": member_id,
+                "state": "active"
+            }
+            for member_id in members
+        ])
     
-    db.commit()
-    db.refresh(plan)
+    invalidate_user_stats(members)
     
     response_data = {
-        "plan": PlanResponse.from_orm(plan).dict(),
+        "plan": PlanResponse.model_validate(plan).model_dump(mode="json"),
         "members": members
     }
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.get("/{plan_id}", response_model=PlanResponse)
-async def get_plan(
+def get_plan(
     plan_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get plan details"""
@@ -98,24 +102,25 @@ async def get_plan(
     if not is_member and plan.created_by != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return PlanResponse.from_orm(plan)
+    return PlanResponse.model_validate(plan)
 
 @router.get("/", response_model=List[PlanResponse])
-async def get_user_plans(
-    db: Session = Depends(get_db),
+def get_user_plans(
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get all plans for current user"""
     
-    # Get plans where user is creator or member
-    member_plan_ids = db.query(PlanMember.plan_id).filter(
+    # Get plans where user is creator or member; each UNION branch is an
+    # index lookup
+    created_plans = db.query(Plan).filter(Plan.created_by == current_user.id)
+    member_plans = db.query(Plan).join(
+        PlanMember, PlanMember.plan_id == Plan.id
+    ).filter(
         PlanMember.user_id == current_user.id,
         PlanMember.state == "active"
-    ).subquery()
+    )
     
-    plans = db.query(Plan).filter(
-        (Plan.created_by == current_user.id) |
-        (Plan.id.in_(member_plan_ids))
-    ).all()
+    plans = created_plans.union(member_plans).all()
     
-    return [PlanResponse.from_orm(plan) for plan in plans]
+    return [PlanResponse.model_validate(plan) for plan in plans]
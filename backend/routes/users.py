@@ -1,75 +1,101 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import List
-from models import User, Plan, PlanResponse, UserResponse
-from database import get_db
+from sqlalchemy import select, func, distinct, exists, and_, or_
+from sqlalchemy.orm import Session, raiseload
+from typing import List, Iterable, Optional
+from cachetools import TTLCache
+import threading
+from models import User, Plan, PlanMember, Transaction, PlanResponse, UserResponse
+from database import get_ro_db
 from auth import get_current_user
 
 router = APIRouter()
 
+# Stats are an aggregate over plans and transactions; cache per user id
+USER_STATS_CACHE_TTL = 300
+
+_stats_cache = TTLCache(maxsize=1024, ttl=USER_STATS_CACHE_TTL)
+_stats_lock = threading.Lock()
+
+def invalidate_user_stats(user_ids: Optional[Iterable[str]] = None):
+    """Drop cached stats for the given users, or for everyone if None"""
+    with _stats_lock:
+        if user_ids is None:
+            _stats_cache.clear()
+            return
+        for user_id in user_ids:
+            _stats_cache.pop(user_id, None)
+
 @router.get("/profile", response_model=UserResponse)
-async def get_user_profile(
+def get_user_profile(
     current_user: User = Depends(get_current_user)
 ):
     """Get current user profile"""
-    return UserResponse.from_orm(current_user)
+    return UserResponse.model_validate(current_user)
 
 @router.get("/plans", response_model=List[PlanResponse])
-async def get_user_plans(
-    db: Session = Depends(get_db),
+def get_user_plans(
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get all plans for current user (creator or member)"""
     
-    from models import PlanMember
-    
     # Get plans where user is creator or member
     member_plan_ids = db.query(PlanMember.plan_id).filter(
         PlanMember.user_id == current_user.id,
         PlanMember.state == "active"
     ).subquery()
     
-    plans = db.query(Plan).filter(
+    # PlanResponse only reads columns; forbid lazy relationship loads
+    plans = db.query(Plan).options(raiseload("*")).filter(
         (Plan.created_by == current_user.id) |
         (Plan.id.in_(member_plan_ids))
     ).order_by(Plan.created_at.desc()).all()
     
-    return [PlanResponse.from_orm(plan) for plan in plans]
+    return [PlanResponse.model_validate(plan) for plan in plans]
 
 @router.get("/stats", response_model=dict)
-async def get_user_stats(
-    db: Session = Depends(get_db),
+def get_user_stats(
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get user statistics"""
     
-    from models import PlanMember, Transaction
-    from sqlalchemy import func
+    with _stats_lock:
+        cached = _stats_cache.get(current_user.id)
+    if cached is not None:
+        return cached
     
-    # Count active plans
-    member_plan_ids = db.query(PlanMember.plan_id).filter(
+    # One pass over the user's plans joined to their completed transactions.
+    # Membership is an EXISTS test rather than a join, so duplicate
+    # membership rows cannot repeat a transaction in the sum.
+    is_member = exists().where(
+        PlanMember.plan_id == Plan.id,
         PlanMember.user_id == current_user.id,
         PlanMember.state == "active"
-    ).subquery()
-    
-    active_plans_count = db.query(Plan).filter(
-        ((Plan.created_by == current_user.id) |
-         (Plan.id.in_(member_plan_ids))) &
-        (Plan.status == "active")
-    ).count()
-    
-    # Calculate total savings (mock calculation)
-    total_transactions = db.query(func.sum(Transaction.amount)).filter(
-        Transaction.plan_id.in_(member_plan_ids),
-        Transaction.status == "completed"
-    ).scalar() or 0
+    )
+    active_plans_count, total_transactions = db.execute(
+        select(
+            func.count(distinct(Plan.id)).filter(Plan.status == "active"),
+            func.coalesce(func.sum(Transaction.amount).filter(is_member), 0)
+        )
+        .select_from(Plan)
+        .outerjoin(Transaction, and_(
+            Transaction.plan_id == Plan.id,
+            Transaction.status == "completed"
+        ))
+        .where(or_(Plan.created_by == current_user.id, is_member))
+    ).one()
     
     # Mock savings calculation (assume 15% savings on group purchases)
     estimated_savings = float(total_transactions) * 0.15
     
-    return {
+    stats = {
         "active_plans": active_plans_count,
         "total_savings": round(estimated_savings, 2),
         "total_transactions": float(total_transactions),
         "member_since": current_user.created_at.isoformat()
     }
+    
+    with _stats_lock:
+        _stats_cache[current_user.id] = stats
+    return stats
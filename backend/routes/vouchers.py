@@ -1,21 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, insert, case, exists
+from sqlalchemy.orm import Session, raiseload
 from typing import List
 from models import (
-    Voucher, VoucherRedemption, Plan, User,
-    VoucherCreate, VoucherResponse
+    Voucher, VoucherRedemption, Plan, Merchant, User,
+    VoucherCreate, VoucherResponse, parse_money
 )
-from database import get_db
+from database import get_db, get_ro_db
 from auth import get_current_user
 from services.idempotency import store_idempotent_response
 from services.ledger import create_ledger_entries
-import uuid
+from services.ids import new_id
 from datetime import datetime
 
 router = APIRouter()
 
 @router.post("/mint", response_model=dict)
-async def mint_vouchers(
+def mint_vouchers(
     request: Request,
     voucher_data: VoucherCreate,
     db: Session = Depends(get_db),
@@ -23,53 +24,55 @@ async def mint_vouchers(
 ):
     """Mint vouchers for plan members"""
     
-    # Verify plan exists and user has access
-    plan = db.query(Plan).filter(Plan.id == voucher_data.plan_id).first()
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan not found")
-    
-    if plan.created_by != current_user.id:
-        raise HTTPException(status_code=403, detail="Only plan creator can mint vouchers")
-    
-    # Create vouchers for each member
-    vouchers = []
-    for member_id in voucher_data.member_user_ids:
-        # Verify user exists
-        user = db.query(User).filter(User.id == member_id).first()
-        if not user:
-            continue
-            
-        voucher = Voucher(
-            id=str(uuid.uuid4()),
-            plan_id=voucher_data.plan_id,
-            member_user_id=member_id,
-            amount=voucher_data.amount,
-            merchant_list=voucher_data.merchant_list,
-            expires_at=voucher_data.expires_at,
-            state="active"
-        )
+    # Checks and the voucher insert run as one transaction
+    with db.begin():
+        # Verify plan exists and user has access
+        plan = db.query(Plan).filter(Plan.id == voucher_data.plan_id).first()
+        if not plan:
+            raise HTTPException(status_code=404, detail="Plan not found")
         
-        db.add(voucher)
-        vouchers.append(voucher)
-    
-    db.commit()
-    
-    # Refresh to get created_at timestamps
-    for voucher in vouchers:
-        db.refresh(voucher)
+        if plan.created_by != current_user.id:
+            raise HTTPException(status_code=403, detail="Only plan creator can mint vouchers")
+        
+        # Verify members exist in one query
+        existing_user_ids = {
+            user_id for (user_id,) in db.query(User.id).filter(
+                User.id.in_(voucher_data.member_user_ids)
+            )
+        }
+        
+        # Insert all vouchers at once; RETURNING hands back the rows with
+        # their server-side defaults, so nothing needs refreshing
+        rows = [
+            {
+                "id": new_id(),
+                "plan_id": voucher_data.plan_id,
+                "member_user_id": member_id,
+                "amount": voucher_data.amount,
+                "merchant_list": voucher_data.merchant_list,
+                "expires_at": voucher_data.expires_at,
+                "state": "active"
+            }
+            for member_id in voucher_data.member_user_ids
+            if member_id in existing_user_ids
+        ]
+        vouchers = db.scalars(
+            insert(Voucher).returning(Voucher, sort_by_parameter_order=True),
+            rows
+        ).all() if rows else []
     
     response_data = {
-        "vouchers": [VoucherResponse.from_orm(v).dict() for v in vouchers]
+        "vouchers": [VoucherResponse.model_validate(v).model_dump(mode="json") for v in vouchers]
     }
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.post("/redeem", response_model=dict)
-async def redeem_vouchers(
+def redeem_vouchers(
     request: Request,
     redemption_data: dict,
     db: Session = Depends(get_db),
@@ -84,53 +87,86 @@ async def redeem_vouchers(
     if len(voucher_ids) != len(amounts):
         raise HTTPException(status_code=400, detail="Voucher IDs and amounts must match")
     
+    # Validate up front so the stored and reported amounts are the same
+    try:
+        amounts = [parse_money(amount) for amount in amounts]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Amounts must be numbers with at most 2 decimal places")
+    
     redeemed = []
     failed = []
-    
-    for i, voucher_id in enumerate(voucher_ids):
-        try:
-            voucher = db.query(Voucher).filter(
-                Voucher.id == voucher_id,
-                Voucher.state == "active"
-            ).first()
-            
-            if not voucher:
-                failed.append({"voucher_id": voucher_id, "reason": "Voucher not found or inactive"})
-                continue
-            
-            if voucher.expires_at < datetime.utcnow():
-                failed.append({"voucher_id": voucher_id, "reason": "Voucher expired"})
-                continue
+    failed_ids = []
+    redemptions = []
+    now = datetime.utcnow()
+    
+    # Debits, redemption rows and failure classification share one transaction
+    with db.begin():
+        # Redemption rows reference the merchant by foreign key
+        if merchant_id is not None and not db.query(
+            exists().where(Merchant.id == merchant_id)
+        ).scalar():
+            raise HTTPException(status_code=404, detail="Merchant not found")
+        
+        for voucher_id, amount_to_redeem in zip(voucher_ids, amounts):
+            # Guarded debit: the balance check and the write are one statement,
+            # so concurrent redeems cannot both spend the same balance
+            remaining = db.execute(
+                update(Voucher)
+                .where(
+                    Voucher.id == voucher_id,
+                    Voucher.state == "active",
+                    Voucher.expires_at >= now,
+                    Voucher.amount >= amount_to_redeem
+                )
+                .values(
+                    amount=Voucher.amount - amount_to_redeem,
+                    state=case(
+                        (Voucher.amount - amount_to_redeem <= 0, "redeemed"),
+                        else_=Voucher.state
+                    )
+                )
+                .returning(Voucher.amount)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
             
-            amount_to_redeem = amounts[i]
-            if amount_to_redeem > voucher.amount:
-                failed.append({"voucher_id": voucher_id, "reason": "Insufficient voucher balance"})
+            if remaining is None:
+                failed_ids.append(voucher_id)
                 continue
             
             # Create redemption record
-            redemption = VoucherRedemption(
-                id=str(uuid.uuid4()),
-                voucher_id=voucher_id,
-                amount=amount_to_redeem,
-                merchant_id=merchant_id
-            )
-            db.add(redemption)
-            
-            # Update voucher balance
-            voucher.amount -= amount_to_redeem
-            if voucher.amount <= 0:
-                voucher.state = "redeemed"
+            redemptions.append({
+                "id": new_id(),
+                "voucher_id": voucher_id,
+                "amount": amount_to_redeem,
+                "merchant_id": merchant_id
+            })
             
             redeemed.append({
                 "voucher_id": voucher_id,
                 "amount": float(amount_to_redeem),
-                "remaining": float(voucher.amount)
+                "remaining": float(remaining)
             })
-            
-        except Exception as e:
-            failed.append({"voucher_id": voucher_id, "reason": str(e)})
-    
-    db.commit()
+        
+        if redemptions:
+            db.execute(insert(VoucherRedemption).values(redemptions))
+        
+        # Work out why the rejected debits did not apply
+        if failed_ids:
+            vouchers_by_id = {
+                v.id: v for v in db.execute(
+                    select(Voucher.id, Voucher.state, Voucher.expires_at)
+                    .where(Voucher.id.in_(failed_ids))
+                )
+            }
+            for voucher_id in failed_ids:
+                voucher = vouchers_by_id.get(voucher_id)
+                if not voucher or voucher.state != "active":
+                    reason = "Voucher not found or inactive"
+                elif voucher.expires_at < now:
+                    reason = "Voucher expired"
+                else:
+                    reason = "Insufficient voucher balance"
+                failed.append({"voucher_id": voucher_id, "reason": reason})
     
     response_data = {
         "result": {
@@ -143,14 +179,14 @@ async def redeem_vouchers(
     
     # Store idempotent response if key provided
     if hasattr(request.state, 'idempotency_key'):
-        store_idempotent_response(request.state.idempotency_key, response_data)
+        store_idempotent_response(db, request.state.idempotency_key, response_data)
     
     return response_data
 
 @router.get("/plan/{plan_id}", response_model=List[VoucherResponse])
-async def get_plan_vouchers(
+def get_plan_vouchers(
     plan_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_ro_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get all vouchers for a plan"""
@@ -160,5 +196,8 @@ async def get_plan_vouchers(
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    vouchers = db.query(Voucher).filter(Voucher.plan_id == plan_id).all()
-    return [VoucherResponse.from_orm(v) for v in vouchers]
+    # VoucherResponse only reads columns; forbid lazy relationship loads
+    vouchers = db.query(Voucher).options(raiseload("*")).filter(
+        Voucher.plan_id == plan_id
+    ).all()
+    return [VoucherResponse.model_validate(v) for v in vouchers]
@@ -1,58 +1,124 @@
 from typing import Optional, Dict, Any
 from models import IdempotentRequest
 from database import get_db_session
-import uuid
-import json
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from cachetools import TTLCache
+import threading
+from datetime import datetime, timedelta
+from services.ids import new_id
+import orjson
+import os
 from fastapi import Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+
+# Keys are honoured for this long; older rows are ignored and purged
+IDEMPOTENCY_WINDOW = timedelta(seconds=int(os.getenv("IDEMPOTENCY_WINDOW", 86400)))
+
+# In-process cache in front of the idempotent_requests table
+CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10_000))
+CACHE_TTL_SECONDS = min(
+    int(os.getenv("IDEMPOTENCY_CACHE_TTL", 3600)),
+    IDEMPOTENCY_WINDOW.total_seconds()
+)
+
+# Responses larger than this are not stored for replay
+MAX_RESPONSE_BYTES = 1024 * 1024
 
 class IdempotencyService:
     """Service to handle idempotent requests"""
     
     def __init__(self):
-        pass
+        self._cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+        self._lock = threading.Lock()
     
-    def get_response(self, idempotency_key: str) -> Optional[Response]:
-        """Get stored response for idempotency key"""
-        db = get_db_session()
+    def get_response(self, idempotency_key: str, db: Optional[Session] = None) -> Optional[Response]:
+        """Get stored response for idempotency key, reusing db if given"""
+        with self._lock:
+            cached = self._cache.get(idempotency_key)
+        if cached is not None:
+            return ORJSONResponse(content=cached)
+        
+        own_session = db is None
+        if own_session:
+            db = get_db_session()
         try:
-            request = db.query(IdempotentRequest).filter(
-                IdempotentRequest.idempotency_key == idempotency_key
-            ).first()
-            
-            if request and request.response_data:
-                return JSONResponse(content=request.response_data)
-            return None
+            response_data = db.execute(
+                select(IdempotentRequest.response_data).where(
+                    IdempotentRequest.idempotency_key == idempotency_key,
+                    IdempotentRequest.created_at >= datetime.utcnow() - IDEMPOTENCY_WINDOW
+                )
+            ).scalar_one_or_none()
         finally:
-            db.close()
+            if own_session:
+                db.close()
+        
+        if not response_data:
+            return None
+        
+        with self._lock:
+            self._cache[idempotency_key] = response_data
+        return ORJSONResponse(content=response_data)
     
-    def store_response(self, idempotency_key: str, response_data: Dict[str, Any]):
-        """Store response for idempotency key"""
+    def store_response(self, idempotency_key: str, response_data: Dict[str, Any], db: Optional[Session] = None):
+        """Store response for idempotency key, reusing db if given"""
+        if len(orjson.dumps(response_data, default=str)) > MAX_RESPONSE_BYTES:
+            return
+        
+        own_session = db is None
+        if own_session:
+            db = get_db_session()
+        try:
+            # First response stored for a key wins; a row outside the window
+            # is treated as absent and overwritten
+            now = datetime.utcnow()
+            stmt = sqlite_insert(IdempotentRequest).values(
+                id=new_id(),
+                idempotency_key=idempotency_key,
+                response_data=response_data,
+                created_at=now
+            )
+            result = db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["idempotency_key"],
+                    set_={
+                        "response_data": stmt.excluded.response_data,
+                        "created_at": stmt.excluded.created_at
+                    },
+                    where=IdempotentRequest.created_at < now - IDEMPOTENCY_WINDOW
+                )
+            )
+            db.commit()
+        finally:
+            if own_session:
+                db.close()
+        
+        if result.rowcount:
+            with self._lock:
+                self._cache[idempotency_key] = response_data
+
+    def purge_expired(self) -> int:
+        """Delete stored responses older than the idempotency window"""
         db = get_db_session()
         try:
-            # Check if already exists
-            existing = db.query(IdempotentRequest).filter(
-                IdempotentRequest.idempotency_key == idempotency_key
-            ).first()
-            
-            if not existing:
-                request = IdempotentRequest(
-                    id=str(uuid.uuid4()),
-                    idempotency_key=idempotency_key,
-                    response_data=response_data
+            result = db.execute(
+                delete(IdempotentRequest).where(
+                    IdempotentRequest.created_at < datetime.utcnow() - IDEMPOTENCY_WINDOW
                 )
-                db.add(request)
-                db.commit()
+            )
+            db.commit()
+            return result.rowcount
         finally:
             db.close()
 
 # Global service instance
 idempotency_service = IdempotencyService()
 
-def store_idempotent_response(idempotency_key: str, response_data: Dict[str, Any]):
-    """Helper function to store idempotent response"""
-    idempotency_service.store_response(idempotency_key, response_data)
+def store_idempotent_response(db: Session, idempotency_key: str, response_data: Dict[str, Any]):
+    """Helper function to store idempotent response on the request's session"""
+    idempotency_service.store_response(idempotency_key, response_data, db)
 
-def get_idempotent_response(idempotency_key: str) -> Optional[Response]:
-    """Helper function to get idempotent response"""
-    return idempotency_service.get_response(idempotency_key)
+def get_idempotent_response(db: Session, idempotency_key: str) -> Optional[Response]:
+    """Helper function to get idempotent response on the request's session"""
+    return idempotency_service.get_response(idempotency_key, db)
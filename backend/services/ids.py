@@ -0,0 +1,42 @@
+import os
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7)
+
+    48 bits of Unix milliseconds, then a 12-bit counter that keeps IDs minted
+    in the same millisecond increasing, then 62 random bits.
+    """
+    global _last_ms, _counter
+
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _counter = int.from_bytes(os.urandom(2), "big") & 0x7FF
+        else:
+            # Same millisecond (or clock stepped back): bump the counter,
+            # borrowing the next millisecond when it overflows
+            _counter += 1
+            if _counter > 0xFFF:
+                _last_ms += 1
+                _counter = 0
+        ms, counter = _last_ms, _counter
+
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (ms & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= counter << 64
+    value |= 0b10 << 62
+    value |= rand_b
+    return uuid.UUID(int=value)
+
+def new_id() -> str:
+    """New primary key; sequential IDs keep inserts at the right edge of the index"""
+    return str(uuid7())
@@ -1,7 +1,8 @@
+from sqlalchemy import insert, func
 from sqlalchemy.orm import Session
-from models import LedgerEntry
+from models import LedgerEntry, AccountBalance
 from decimal import Decimal
-import uuid
+from services.ids import new_id
 
 def create_ledger_entries(
     db: Session,
@@ -13,61 +14,56 @@ def create_ledger_entries(
     """Create double-entry ledger entries for a transaction"""
     
     # Debit entry
-    debit_entry = LedgerEntry(
-        id=str(uuid.uuid4()),
-        txn_id=transaction_id,
-        account=account_debit,
-        leg="debit",
-        amount=amount
-    )
+    debit_entry = {
+        "id": new_id(),
+        "txn_id": transaction_id,
+        "account": account_debit,
+        "leg": "debit",
+        "amount": amount
+    }
     
     # Credit entry
-    credit_entry = LedgerEntry(
-        id=str(uuid.uuid4()),
-        txn_id=transaction_id,
-        account=account_credit,
-        leg="credit",
-        amount=amount
-    )
+    credit_entry = {
+        "id": new_id(),
+        "txn_id": transaction_id,
+        "account": account_credit,
+        "leg": "credit",
+        "amount": amount
+    }
     
-    db.add(debit_entry)
-    db.add(credit_entry)
+    # Both legs go out as one multi-row INSERT ... VALUES (...), (...)
+    db.execute(insert(LedgerEntry).values([debit_entry, credit_entry]))
     
     return debit_entry, credit_entry
 
+def _sum_legs(db: Session, *criteria):
+    """Sum debit and credit amounts in one pass over matching entries"""
+    
+    debits, credits = db.query(
+        func.sum(LedgerEntry.amount).filter(LedgerEntry.leg == "debit"),
+        func.sum(LedgerEntry.amount).filter(LedgerEntry.leg == "credit")
+    ).filter(*criteria).one()
+    
+    return debits or Decimal('0'), credits or Decimal('0')
+
 def get_account_balance(db: Session, account: str) -> Decimal:
     """Calculate account balance from ledger entries"""
     
-    from sqlalchemy import func
-    
-    # Sum all credits
-    credits = db.query(func.sum(LedgerEntry.amount)).filter(
-        LedgerEntry.account == account,
-        LedgerEntry.leg == "credit"
-    ).scalar() or Decimal('0')
+    # Balance = Credits - Debits (for asset accounts); for liability
+    # accounts negate it. SQLite keeps it in account_balances via a trigger
+    # on ledger_entries; other databases have no trigger, so sum the legs.
+    if db.get_bind().dialect.name != "sqlite":
+        debits, credits = _sum_legs(db, LedgerEntry.account == account)
+        return credits - debits
     
-    # Sum all debits
-    debits = db.query(func.sum(LedgerEntry.amount)).filter(
-        LedgerEntry.account == account,
-        LedgerEntry.leg == "debit"
+    return db.query(AccountBalance.balance).filter(
+        AccountBalance.account == account
     ).scalar() or Decimal('0')
-    
-    # Balance = Credits - Debits (for asset accounts)
-    # For liability accounts, it would be Debits - Credits
-    return credits - debits
 
 def verify_ledger_balance(db: Session) -> bool:
     """Verify that the ledger is balanced (total debits = total credits)"""
     
-    from sqlalchemy import func
-    
-    total_debits = db.query(func.sum(LedgerEntry.amount)).filter(
-        LedgerEntry.leg == "debit"
-    ).scalar() or Decimal('0')
-    
-    total_credits = db.query(func.sum(LedgerEntry.amount)).filter(
-        LedgerEntry.leg == "credit"
-    ).scalar() or Decimal('0')
+    total_debits, total_credits = _sum_legs(db)
     
     return total_debits == total_credits
 
@@ -1,33 +1,136 @@
 import pytest
+import pytest_asyncio
 import httpx
-from fastapi.testclient import TestClient
+from sqlalchemy import Select, create_engine, insert, func, select
+from sqlalchemy.orm import Session, raiseload
 from main import app
-from database import get_db_session, create_tables
+from database import engine, get_db, get_ro_db, get_ro_session_factory, create_tables
+from models import Base, Plan, PlanMember, Voucher, User, Merchant, LedgerEntry, AccountBalance
+import seed_data
 from seed_data import seed_database
+from auth import _user_cache, _user_cache_lock
+from services.idempotency import idempotency_service
+from routes.users import invalidate_user_stats
+from routes.merchants import clear_merchant_cache
+from services.ledger import (
+    create_ledger_entries, get_account_balance, verify_ledger_balance, _sum_legs
+)
+from decimal import Decimal
 import uuid
 
-client = TestClient(app)
+pytestmark = pytest.mark.asyncio
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def setup_test_db():
-    """Setup test database"""
+    """Create and seed the test database once per test session"""
     create_tables()
     seed_database()
     yield
-    # Cleanup if needed
 
-def get_auth_token():
+def clear_process_caches():
+    """Empty the in-process caches so no test sees another test's rows"""
+    with _user_cache_lock:
+        _user_cache.clear()
+    with idempotency_service._lock:
+        idempotency_service._cache.clear()
+    invalidate_user_stats()
+    clear_merchant_cache()
+
+@pytest.fixture
+def db_connection(setup_test_db):
+    """Connection whose writes are rolled back after each test"""
+    connection = engine.connect()
+    # pysqlite defers BEGIN until the first write and would turn the first
+    # SAVEPOINT into the outer transaction; take over transaction control
+    driver_connection = connection.connection.driver_connection
+    driver_connection.isolation_level = None
+    transaction = connection.begin()
+    connection.exec_driver_sql("BEGIN")
+    clear_process_caches()
+    
+    def make_session(join_transaction_mode):
+        return Session(
+            bind=connection,
+            join_transaction_mode=join_transaction_mode,
+            autoflush=False,
+            expire_on_commit=False
+        )
+    
+    def session_factory(join_transaction_mode):
+        def override():
+            db = make_session(join_transaction_mode)
+            try:
+                yield db
+            finally:
+                db.close()
+        return override
+    
+    # Route commits release a SAVEPOINT instead of the outer transaction.
+    # Read-only sessions join without a SAVEPOINT of their own: closing one
+    # opened before the route's would roll back the route's released writes.
+    app.dependency_overrides[get_db] = session_factory("create_savepoint")
+    app.dependency_overrides[get_ro_db] = session_factory("rollback_only")
+    app.dependency_overrides[get_ro_session_factory] = lambda: (
+        lambda: make_session("rollback_only")
+    )
+    yield connection
+    
+    app.dependency_overrides.clear()
+    clear_process_caches()
+    transaction.rollback()
+    driver_connection.isolation_level = ""
+    connection.close()
+
+@pytest_asyncio.fixture
+async def client(db_connection):
+    """In-process async client; requests never leave the event loop"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test", follow_redirects=True
+    ) as ac:
+        yield ac
+
+# Entities whose serializers must never trigger lazy relationship loads
+RAISELOAD_ENTITIES = (Plan, Voucher, User)
+
+def _loads_watched_entity(items):
+    # Identity checks: `in` would compare via column __eq__ overloads
+    return any(item is entity for item in items for entity in RAISELOAD_ENTITIES)
+
+@pytest.fixture(autouse=True)
+def raise_on_lazy_load(monkeypatch):
+    """Make any lazy relationship load on Plan/Voucher/User queries raise"""
+    original_query = Session.query
+    original_execute = Session.execute
+
+    def query(self, *entities, **kwargs):
+        q = original_query(self, *entities, **kwargs)
+        if _loads_watched_entity(entities):
+            q = q.options(raiseload("*"))
+        return q
+
+    def execute(self, statement, *args, **kwargs):
+        if isinstance(statement, Select) and _loads_watched_entity(
+            desc["expr"] for desc in statement.column_descriptions
+        ):
+            statement = statement.options(raiseload("*"))
+        return original_execute(self, statement, *args, **kwargs)
+
+    monkeypatch.setattr(Session, "query", query)
+    monkeypatch.setattr(Session, "execute", execute)
+
+async def get_auth_token(client):
     """Get auth token for testing"""
-    response = client.post("/api/auth/mock_login", json={"phone": "+91 9876543210"})
+    response = await client.post("/api/auth/mock_login", json={"phone": "+91 9876543210"})
     assert response.status_code == 200
     return response.json()["token"]
 
 class TestIdempotency:
     """Test idempotency functionality"""
     
-    def test_idempotent_plan_creation(self, setup_test_db):
+    async def test_idempotent_plan_creation(self, client):
         """Test that plan creation is idempotent"""
-        token = get_auth_token()
+        token = await get_auth_token(client)
         headers = {
             "Authorization": f"Bearer {token}",
             "idempotency-key": str(uuid.uuid4())
@@ -43,12 +146,12 @@ class TestIdempotency:
         }
         
         # First request
-        response1 = client.post("/api/plans/", json=plan_data, headers=headers)
+        response1 = await client.post("/api/plans/", json=plan_data, headers=headers)
         assert response1.status_code == 200
         plan_id_1 = response1.json()["plan"]["id"]
         
         # Second request with same idempotency key
-        response2 = client.post("/api/plans/", json=plan_data, headers=headers)
+        response2 = await client.post("/api/plans/", json=plan_data, headers=headers)
         assert response2.status_code == 200
         plan_id_2 = response2.json()["plan"]["id"]
         
@@ -58,9 +161,9 @@ class TestIdempotency:
 class TestVoucherRedemption:
     """Test voucher redemption with multiple legs"""
     
-    def test_voucher_redeem_splits_correctly(self, setup_test_db):
+    async def test_voucher_redeem_splits_correctly(self, client):
         """Test that voucher redemption splits into correct number of legs"""
-        token = get_auth_token()
+        token = await get_auth_token(client)
         headers = {"Authorization": f"Bearer {token}"}
         
         # First create vouchers
@@ -69,10 +172,10 @@ class TestVoucherRedemption:
             "member_user_ids": ["user-1", "user-2", "user-3"],
             "amount": 100.0,
             "merchant_list": [],
-            "expires_at": "2024-12-31T23:59:59"
+            "expires_at": "2099-12-31T23:59:59"
         }
         
-        voucher_response = client.post("/api/vouchers/mint", json=voucher_data, headers=headers)
+        voucher_response = await client.post("/api/vouchers/mint", json=voucher_data, headers=headers)
         assert voucher_response.status_code == 200
         vouchers = voucher_response.json()["vouchers"]
         assert len(vouchers) == 3
@@ -84,20 +187,43 @@ class TestVoucherRedemption:
             "merchant_id": "merchant-campus-1-0"
         }
         
-        redemption_response = client.post("/api/vouchers/redeem", json=redemption_data, headers=headers)
+        redemption_response = await client.post("/api/vouchers/redeem", json=redemption_data, headers=headers)
         assert redemption_response.status_code == 200
         
         result = redemption_response.json()["result"]
         assert result["total_redeemed"] == 2
         assert result["total_failed"] == 0
         assert len(result["redeemed"]) == 2
+    
+    async def test_unknown_merchant_is_rejected(self, client):
+        """Test that redeeming at a merchant that does not exist returns 404"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        voucher_data = {
+            "plan_id": "plan-demo-1",
+            "member_user_ids": ["user-1"],
+            "amount": 100.0,
+            "merchant_list": [],
+            "expires_at": "2099-12-31T23:59:59"
+        }
+        voucher_response = await client.post("/api/vouchers/mint", json=voucher_data, headers=headers)
+        voucher = voucher_response.json()["vouchers"][0]
+        
+        redemption_data = {
+            "voucher_ids": [voucher["id"]],
+            "amounts": [50.0],
+            "merchant_id": "merchant-typo"
+        }
+        response = await client.post("/api/vouchers/redeem", json=redemption_data, headers=headers)
+        assert response.status_code == 404
 
 class TestGuardrails:
     """Test over-cap guardrail functionality"""
     
-    def test_over_cap_returns_guardrail_flag(self, setup_test_db):
+    async def test_over_cap_returns_guardrail_flag(self, client):
         """Test that over-cap amount triggers guardrail"""
-        token = get_auth_token()
+        token = await get_auth_token(client)
         headers = {"Authorization": f"Bearer {token}"}
         
         # Create payment intent with high amount (triggers guardrail)
@@ -108,7 +234,7 @@ class TestGuardrails:
             "mode": "vouchers"
         }
         
-        response = client.post("/api/payments/intent", json=intent_data, headers=headers)
+        response = await client.post("/api/payments/intent", json=intent_data, headers=headers)
         assert response.status_code == 200
         
         result = response.json()
@@ -117,7 +243,7 @@ class TestGuardrails:
         
         # Test with normal amount (no guardrail)
         intent_data["amount"] = 150.0
-        response = client.post("/api/payments/intent", json=intent_data, headers=headers)
+        response = await client.post("/api/payments/intent", json=intent_data, headers=headers)
         assert response.status_code == 200
         
         result = response.json()
@@ -126,11 +252,11 @@ class TestGuardrails:
 class TestAuthentication:
     """Test authentication flows"""
     
-    def test_mock_login_creates_user(self, setup_test_db):
+    async def test_mock_login_creates_user(self, client):
         """Test that mock login creates new user if doesn't exist"""
         new_phone = "+91 9999999999"
         
-        response = client.post("/api/auth/mock_login", json={"phone": new_phone})
+        response = await client.post("/api/auth/mock_login", json={"phone": new_phone})
         assert response.status_code == 200
         
         result = response.json()
@@ -139,26 +265,27 @@ class TestAuthentication:
         assert result["user"]["phone"] == new_phone
         assert result["user"]["name"] == "User 9999"  # Generated name
         
-    def test_protected_route_requires_auth(self, setup_test_db):
+    async def test_protected_route_requires_auth(self, client):
         """Test that protected routes require authentication"""
-        response = client.get("/api/me/plans")
-        assert response.status_code == 401
+        response = await client.get("/api/me/plans")
+        # HTTPBearer rejects a missing Authorization header with 403
+        assert response.status_code == 403
 
 class TestMerchants:
     """Test merchant endpoints"""
     
-    def test_get_merchants_by_campus(self, setup_test_db):
+    async def test_get_merchants_by_campus(self, client):
         """Test filtering merchants by campus"""
-        response = client.get("/api/merchants?campus_id=campus-1")
+        response = await client.get("/api/merchants?campus_id=campus-1")
         assert response.status_code == 200
         
         merchants = response.json()
         assert len(merchants) == 20  # 20 merchants per campus
         assert all(m["campus_id"] == "campus-1" for m in merchants)
         
-    def test_get_merchants_by_category(self, setup_test_db):
+    async def test_get_merchants_by_category(self, client):
         """Test filtering merchants by category"""
-        response = client.get("/api/merchants?category=food")
+        response = await client.get("/api/merchants?category=food")
         assert response.status_code == 200
         
         merchants = response.json()
@@ -167,9 +294,9 @@ class TestMerchants:
 class TestPlans:
     """Test plan management"""
     
-    def test_create_and_retrieve_plan(self, setup_test_db):
+    async def test_create_and_retrieve_plan(self, client):
         """Test creating and retrieving a plan"""
-        token = get_auth_token()
+        token = await get_auth_token(client)
         headers = {"Authorization": f"Bearer {token}"}
         
         plan_data = {
@@ -182,19 +309,252 @@ class TestPlans:
         }
         
         # Create plan
-        response = client.post("/api/plans/", json=plan_data, headers=headers)
+        response = await client.post("/api/plans/", json=plan_data, headers=headers)
         assert response.status_code == 200
         
         created_plan = response.json()["plan"]
         plan_id = created_plan["id"]
         
         # Retrieve plan
-        response = client.get(f"/api/plans/{plan_id}", headers=headers)
+        response = await client.get(f"/api/plans/{plan_id}", headers=headers)
         assert response.status_code == 200
         
         retrieved_plan = response.json()
         assert retrieved_plan["name"] == plan_data["name"]
         assert float(retrieved_plan["cap_per_head"]) == plan_data["cap_per_head"]
+        
+        # The create response carries the amount exactly as reads return it
+        assert created_plan["cap_per_head"] == retrieved_plan["cap_per_head"] == "300.00"
+
+async def create_paid_plan(client, headers, member_ids, amount=100.0):
+    """Create a plan and confirm one completed payment against it"""
+    plan_data = {
+        "name": "Paid Plan",
+        "cap_per_head": 300.0,
+        "window_start": "2024-12-25T18:00:00",
+        "window_end": "2024-12-25T22:00:00",
+        "merchant_whitelist": ["merchant-campus-1-0"],
+        "member_ids": member_ids
+    }
+    response = await client.post("/api/plans/", json=plan_data, headers=headers)
+    assert response.status_code == 200
+    plan_id = response.json()["plan"]["id"]
+    
+    intent_data = {
+        "amount": amount,
+        "merchant_id": "merchant-campus-1-0",
+        "plan_id": plan_id,
+        "mode": "vouchers"
+    }
+    response = await client.post("/api/payments/intent", json=intent_data, headers=headers)
+    assert response.status_code == 200
+    
+    confirm_data = {"intent_id": response.json()["intent_id"], "status": "completed"}
+    response = await client.post("/api/payments/confirm", json=confirm_data, headers=headers)
+    assert response.status_code == 200
+    return plan_id
+
+class TestTransactions:
+    """Test transaction history"""
+    
+    async def test_duplicate_member_ids_list_transaction_once(self, client):
+        """Test that a member listed twice sees each transaction once"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        plan_id = await create_paid_plan(client, headers, ["user-1", "user-1", "user-2"])
+        
+        response = await client.get("/api/payments/transactions", headers=headers)
+        assert response.status_code == 200
+        
+        plan_transactions = [t for t in response.json() if t["plan_id"] == plan_id]
+        assert len(plan_transactions) == 1
+
+class TestUserStats:
+    """Test user statistics"""
+    
+    async def test_duplicate_membership_counts_payment_once(self, client, db_connection):
+        """Test that duplicate membership rows do not double transaction totals"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = await client.get("/api/me/stats", headers=headers)
+        assert response.status_code == 200
+        before = response.json()["total_transactions"]
+        
+        plan_id = await create_paid_plan(client, headers, ["user-1"], amount=100.0)
+        db_connection.execute(insert(PlanMember).values(
+            id=str(uuid.uuid4()), plan_id=plan_id, user_id="user-1", state="active"
+        ))
+        invalidate_user_stats()
+        
+        response = await client.get("/api/me/stats", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["total_transactions"] == before + 100.0
+
+class TestLedger:
+    """Test ledger account balances"""
+    
+    async def test_confirmed_payment_updates_account_balances(self, client, db_connection):
+        """Test that ledger inserts keep account_balances in step with the legs"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        db = Session(bind=db_connection, join_transaction_mode="rollback_only")
+        merchant_account = "merchant_merchant-campus-1-0"
+        before = get_account_balance(db, merchant_account)
+        
+        plan_id = await create_paid_plan(client, headers, ["user-2"], amount=100.0)
+        
+        assert get_account_balance(db, merchant_account) == before + Decimal("100.00")
+        assert get_account_balance(db, f"plan_{plan_id}") == Decimal("-100.00")
+        
+        # The trigger-maintained rows agree with summing the legs
+        debits, credits = _sum_legs(db, LedgerEntry.account == merchant_account)
+        assert get_account_balance(db, merchant_account) == credits - debits
+        assert verify_ledger_balance(db)
+        db.close()
+    
+    async def test_backfill_fills_balances_for_existing_ledger(self):
+        """Test that creating account_balances on an existing DB backfills it"""
+        memory_engine = create_engine("sqlite://")
+        tables = [t for t in Base.metadata.sorted_tables if t is not AccountBalance.__table__]
+        Base.metadata.create_all(memory_engine, tables=tables)
+        
+        with memory_engine.begin() as conn:
+            conn.execute(insert(LedgerEntry).values([
+                {"id": "l1", "account": "a", "leg": "credit", "amount": Decimal("50.25")},
+                {"id": "l2", "account": "b", "leg": "debit", "amount": Decimal("50.25")},
+                {"id": "l3", "account": "a", "leg": "debit", "amount": Decimal("10")},
+            ]))
+        
+        Base.metadata.create_all(memory_engine)
+        
+        with Session(memory_engine) as db:
+            assert get_account_balance(db, "a") == Decimal("40.25")
+            assert get_account_balance(db, "b") == Decimal("-50.25")
+            
+            # New entries keep flowing into the backfilled rows
+            create_ledger_entries(db, "t1", Decimal("5"), "a", "b")
+            assert get_account_balance(db, "a") == Decimal("35.25")
+            assert get_account_balance(db, "b") == Decimal("-45.25")
+        memory_engine.dispose()
+
+class TestMandates:
+    """Test mandate management"""
+    
+    async def test_create_response_matches_listing(self, client):
+        """Test that created mandates report caps exactly as listings do"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mandate_data = {
+            "plan_id": "plan-demo-1",
+            "member_user_ids": ["user-2"],
+            "cap_amount": 100,
+            "valid_from": "2024-12-25T18:00:00",
+            "valid_to": "2099-12-25T22:00:00"
+        }
+        response = await client.post("/api/mandates/create", json=mandate_data, headers=headers)
+        assert response.status_code == 200
+        created = response.json()["mandates"][0]
+        
+        response = await client.get("/api/mandates/plan/plan-demo-1", headers=headers)
+        assert response.status_code == 200
+        listed = next(m for m in response.json() if m["id"] == created["id"])
+        
+        assert created["cap_amount"] == listed["cap_amount"] == "100.00"
+    
+    async def test_execute_with_unknown_merchant_keeps_cap(self, client):
+        """Test that executing at a merchant that does not exist returns 404"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mandate_data = {
+            "plan_id": "plan-demo-1",
+            "member_user_ids": ["user-2"],
+            "cap_amount": 100,
+            "valid_from": "2024-12-25T18:00:00",
+            "valid_to": "2099-12-25T22:00:00"
+        }
+        response = await client.post("/api/mandates/create", json=mandate_data, headers=headers)
+        mandate_id = response.json()["mandates"][0]["id"]
+        
+        execution_data = {"mandate_id": mandate_id, "amount": 10, "merchant_id": "nope"}
+        response = await client.post("/api/mandates/execute", json=execution_data, headers=headers)
+        assert response.status_code == 404
+        
+        response = await client.get("/api/mandates/plan/plan-demo-1", headers=headers)
+        listed = next(m for m in response.json() if m["id"] == mandate_id)
+        assert listed["cap_amount"] == "100.00"
+
+class TestAmounts:
+    """Test money amount validation"""
+    
+    async def test_sub_paise_amounts_are_rejected(self, client):
+        """Test that amounts with more than 2 decimal places are not rounded silently"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        intent_data = {
+            "amount": 3.333,
+            "merchant_id": "merchant-campus-1-0",
+            "plan_id": "plan-demo-1",
+            "mode": "vouchers"
+        }
+        response = await client.post("/api/payments/intent", json=intent_data, headers=headers)
+        assert response.status_code == 422
+        
+        execution_data = {"mandate_id": "any-mandate", "amount": 3.333}
+        response = await client.post("/api/mandates/execute", json=execution_data, headers=headers)
+        assert response.status_code == 400
+    
+    async def test_mandate_execution_reports_stored_amount(self, client):
+        """Test that an executed amount is reported as it was recorded"""
+        token = await get_auth_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mandate_data = {
+            "plan_id": "plan-demo-1",
+            "member_user_ids": ["user-2"],
+            "cap_amount": 10,
+            "valid_from": "2024-12-25T18:00:00",
+            "valid_to": "2099-12-25T22:00:00"
+        }
+        response = await client.post("/api/mandates/create", json=mandate_data, headers=headers)
+        mandate_id = response.json()["mandates"][0]["id"]
+        
+        execution_data = {"mandate_id": mandate_id, "amount": 3.33}
+        response = await client.post("/api/mandates/execute", json=execution_data, headers=headers)
+        assert response.status_code == 200
+        
+        result = response.json()["result"]
+        assert result["amount"] == 3.33
+        assert result["remaining_cap"] == 6.67
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
+
+class TestSeed:
+    """Test background database seeding"""
+    
+    async def test_seed_runs_when_a_login_beat_it(self, monkeypatch):
+        """Test that a user created before seeding does not stop or break it"""
+        memory_engine = create_engine("sqlite://")
+        Base.metadata.create_all(memory_engine)
+        monkeypatch.setattr(seed_data, "get_db_session", lambda: Session(memory_engine))
+        
+        # What a mock_login that lands before the seed task commits
+        with memory_engine.begin() as conn:
+            conn.execute(insert(User).values(
+                id="early-user", phone="+91 9876543210", name="Early", email="early@example.com"
+            ))
+        
+        seed_database()
+        seed_database()
+        
+        with Session(memory_engine) as db:
+            assert db.scalar(select(func.count()).select_from(Merchant)) == 60
+            assert db.scalar(select(func.count()).select_from(User)) == 8
+            assert db.get(Plan, "plan-demo-1").created_by == "early-user"
+        memory_engine.dispose()
@@ -5,20 +5,176 @@ Supports MockCoach (rule-based) and OpenAI-compatible providers (Qwen).
 
 import os
 import json
+import functools
+import operator
 import re
-from typing import Dict, List, Any, Optional, Union
-from abc import ABC, abstractmethod
-import requests
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Protocol, Union
 
-class AIProvider(ABC):
-    """Abstract base class for AI providers."""
+# orjson is much faster on the chat path; fall back to the stdlib when it is
+# not installed. Both loads() accept bytes, and orjson's decode error
+# subclasses json.JSONDecodeError.
+try:
+    import orjson
     
-    @abstractmethod
-    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
-        """Generate chat completion with optional tool calls."""
-        pass
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+# PII patterns, compiled once per process. Phone numbers and UPI IDs share
+# one alternation; the group name is the token prefix for each match.
+_PII_RE = re.compile(r'(?P<PHONE>\+?\d{10,15})|(?P<UPI>[\w\.-]+@[\w\.-]+)')
+
+# Tool names that look like direct fund movement are never executed
+_DENY_TOOL_RE = re.compile(r'transfer|send', re.IGNORECASE)
+
+# MockCoach matches keywords per run of lowercase letters, memoising the
+# rule found for each word up to this many entries
+_WORD_RE = re.compile(r'[a-z]+')
+WORD_CACHE_SIZE = 4096
+
+# Canned tool call arguments for MockCoach rules
+_TOOL_CALL_ARGS = {
+    "create_plan": {
+        "name": "AI Suggested Plan",
+        "cap_per_head": 300.0,
+        "duration_hours": 4,
+        "member_count": 3
+    },
+    "mint_vouchers": {
+        "amount": 200.0,
+        "member_count": 3,
+        "expires_in_hours": 24
+    },
+    "create_mandates": {
+        "cap_amount": 250.0,
+        "member_count": 3,
+        "valid_hours": 12
+    },
+    "suggest_merchants": {
+        "category": "food",
+        "max_results": 5
+    },
+    "trim_suggestions": {
+        "current_amount": 400.0,
+        "target_reduction": 50.0
+    }
+}
+
+# Full tool calls, with the arguments serialized once (compactly) at import
+_TOOL_CALL_TEMPLATES = {
+    name: {
+        "id": f"call_{name}",
+        "type": "function",
+        "function": {
+            "name": name,
+            "arguments": _json_dumps(args)
+        }
+    }
+    for name, args in _TOOL_CALL_ARGS.items()
+}
+
+# Provider configuration, read once per process
+USE_MOCK_AI = os.getenv("USE_MOCK_AI", "true").lower() == "true"
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+QWEN_MODEL = os.getenv("QWEN_MODEL", "qwen2.5-7b-instruct")
+
+def _assistant_response(content: str, tool_call: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    message = {"role": "assistant", "content": content}
+    if tool_call:
+        message["tool_calls"] = [tool_call]
+    return {"choices": [{"message": message}]}
+
+# Fixed MockCoach replies, built once and shared; callers only serialize them
+_GREETING_RESPONSE = _assistant_response(
+    "Hello! I'm your AeonPay AI coach. How can I help you with your spending plans today?"
+)
+_DEFAULT_RESPONSE = _assistant_response(
+    "I can help you with creating plans, minting vouchers, setting up mandates, finding merchants, or trimming expenses. What would you like to do?"
+)
+
+# Exact-match response cache, off by default: prompts can still carry
+# user-specific content after PII redaction
+AI_RESPONSE_CACHE = os.getenv("AI_RESPONSE_CACHE", "false").lower() == "true"
+AI_RESPONSE_CACHE_TTL = int(os.getenv("AI_RESPONSE_CACHE_TTL", "300"))
+AI_RESPONSE_CACHE_SIZE = 1024
+
+class _ResponseCache:
+    """Thread-safe LRU whose entries expire after a fixed TTL."""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+_response_cache = _ResponseCache(AI_RESPONSE_CACHE_SIZE, AI_RESPONSE_CACHE_TTL)
+
+def _cache_key(provider: "AIProvider", messages: List[Dict[str, str]], tools: Optional[List[Dict]], stream: bool = False):
+    """Key for a completion request, or None when it should not be cached."""
+    if not AI_RESPONSE_CACHE:
+        return None
+    # Only plain role/content turns; tool results and calls carry more state
+    if any(m.keys() - {"role", "content"} for m in messages):
+        return None
+    try:
+        key = (
+            type(provider).__name__,
+            # Streamed replies are reassembled into a slightly different shape
+            bool(stream),
+            tuple((m.get("role"), m.get("content")) for m in messages),
+            tuple(sorted((t.get("function") or {}).get("name", "") for t in tools or []))
+        )
+        hash(key)
+    except (TypeError, AttributeError):
+        return None
+    return key
+
+class AIProvider(Protocol):
+    """Interface every AI provider implements (structural, no base class)."""
+    
+    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, stream: bool = False) -> Dict[str, Any]:
+        """Generate chat completion with optional tool calls.
+        
+        stream=True asks for the reply to be read incrementally; the result
+        has the same shape either way.
+        """
+        ...
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Async chat completion."""
+        ...
 
-class MockCoach(AIProvider):
+class MockCoach:
     """Rule-based AI coach for development and fallback."""
     
     def __init__(self):
@@ -49,137 +205,153 @@ class MockCoach(AIProvider):
                 "tool": "trim_suggestions"
             }
         }
+        
+        # Messages are lowercased before matching, so keywords must be too
+        for rule in self.rules.values():
+            rule["keywords"] = [sys.intern(k.lower()) for k in rule["keywords"]]
+        
+        # Keyword index: each keyword maps straight to the priority of the
+        # first rule listing it, and one lookahead alternation (ordered by
+        # rule priority) reports every keyword occurrence in a single scan
+        self._rule_names = list(self.rules)
+        self._keyword_priority = {}
+        for priority, rule in enumerate(self.rules.values()):
+            for keyword in rule["keywords"]:
+                self._keyword_priority.setdefault(keyword, priority)
+        self._keyword_re = re.compile(
+            "(?=(" + "|".join(map(re.escape, self._keyword_priority)) + "))"
+        )
+        
+        # Keywords are plain lowercase words, so every occurrence sits inside
+        # one run of letters. Matching per distinct word lets repeated words
+        # resolve with a dict lookup; keywords themselves are resolved up front.
+        self._words_only = all(_WORD_RE.fullmatch(kw) for kw in self._keyword_priority)
+        self._word_priority = {kw: self._scan_priority(kw) for kw in self._keyword_priority}
+        
+        # Canned replies per rule: (without tool call, with tool call or None)
+        self._rule_responses = {}
+        for rule_name, rule in self.rules.items():
+            tool_call = self._generate_tool_call(rule_name, "")
+            self._rule_responses[rule_name] = (
+                _assistant_response(rule["response"]),
+                _assistant_response(rule["response"], tool_call) if tool_call else None
+            )
     
-    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
-        """Generate rule-based responses with tool calls."""
+    def _scan_priority(self, text: str) -> int:
+        """Best rule priority among keyword occurrences in text."""
+        best_priority = len(self._rule_names)
+        for match in self._keyword_re.finditer(text):
+            priority = self._keyword_priority[match.group(1)]
+            if priority < best_priority:
+                best_priority = priority
+                if priority == 0:
+                    break
+        return best_priority
+    
+    def _match_rule(self, user_message: str) -> Optional[str]:
+        """Return the highest-priority rule with a keyword in the message."""
+        if not self._words_only:
+            best_priority = self._scan_priority(user_message)
+        else:
+            best_priority = len(self._rule_names)
+            for word in set(_WORD_RE.findall(user_message)):
+                priority = self._word_priority.get(word)
+                if priority is None:
+                    priority = self._scan_priority(word)
+                    if len(self._word_priority) < WORD_CACHE_SIZE:
+                        self._word_priority[word] = priority
+                if priority < best_priority:
+                    best_priority = priority
+                    if priority == 0:
+                        break
+        if best_priority < len(self._rule_names):
+            return self._rule_names[best_priority]
+        return None
+    
+    def classify(self, user_messages: Iterable[str]) -> List[Optional[str]]:
+        """Matched rule name (or None) for each message, for batch scoring.
+        
+        Runs the same matcher as chat_completion without building responses;
+        the word memo is shared across the batch, so repeated vocabulary
+        resolves with dict lookups.
+        """
+        return [self._match_rule(message.lower()) for message in user_messages]
+    
+    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, stream: bool = False) -> Dict[str, Any]:
+        """Generate rule-based responses with tool calls (stream has no effect)."""
+        key = _cache_key(self, messages, tools)
+        if key is not None:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                return cached
+        response = self._respond(messages, tools)
+        if key is not None:
+            _response_cache.put(key, response)
+        return response
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Rule lookup never blocks, so the async form just answers inline."""
+        return self.chat_completion(messages, tools)
+    
+    def _respond(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]]) -> Dict[str, Any]:
         if not messages:
-            return {
-                "choices": [{
-                    "message": {
-                        "role": "assistant",
-                        "content": "Hello! I'm your AeonPay AI coach. How can I help you with your spending plans today?"
-                    }
-                }]
-            }
+            return _GREETING_RESPONSE
         
         user_message = messages[-1].get("content", "").lower()
         
         # Find matching rule
-        for rule_name, rule in self.rules.items():
-            if any(keyword in user_message for keyword in rule["keywords"]):
-                tool_call = None
-                if tools:
-                    # Generate appropriate tool call
-                    tool_call = self._generate_tool_call(rule_name, user_message)
-                
-                response = {
-                    "choices": [{
-                        "message": {
-                            "role": "assistant",
-                            "content": rule["response"]
-                        }
-                    }]
-                }
-                
-                if tool_call:
-                    response["choices"][0]["message"]["tool_calls"] = [tool_call]
-                
-                return response
+        rule_name = self._match_rule(user_message)
+        if rule_name is not None:
+            plain, with_tool = self._rule_responses[rule_name]
+            return with_tool if tools and with_tool else plain
         
-        # Default response
-        return {
-            "choices": [{
-                "message": {
-                    "role": "assistant",
-                    "content": "I can help you with creating plans, minting vouchers, setting up mandates, finding merchants, or trimming expenses. What would you like to do?"
-                }
-            }]
-        }
+        return _DEFAULT_RESPONSE
     
     def _generate_tool_call(self, rule_name: str, user_message: str) -> Dict[str, Any]:
         """Generate appropriate tool call based on rule and user message."""
-        tool_calls = {
-            "create_plan": {
-                "id": "call_create_plan",
-                "type": "function",
-                "function": {
-                    "name": "create_plan",
-                    "arguments": json.dumps({
-                        "name": "AI Suggested Plan",
-                        "cap_per_head": 300.0,
-                        "duration_hours": 4,
-                        "member_count": 3
-                    })
-                }
-            },
-            "mint_vouchers": {
-                "id": "call_mint_vouchers",
-                "type": "function", 
-                "function": {
-                    "name": "mint_vouchers",
-                    "arguments": json.dumps({
-                        "amount": 200.0,
-                        "member_count": 3,
-                        "expires_in_hours": 24
-                    })
-                }
-            },
-            "create_mandates": {
-                "id": "call_create_mandates",
-                "type": "function",
-                "function": {
-                    "name": "create_mandates", 
-                    "arguments": json.dumps({
-                        "cap_amount": 250.0,
-                        "member_count": 3,
-                        "valid_hours": 12
-                    })
-                }
-            },
-            "suggest_merchants": {
-                "id": "call_suggest_merchants",
-                "type": "function",
-                "function": {
-                    "name": "suggest_merchants",
-                    "arguments": json.dumps({
-                        "category": "food",
-                        "max_results": 5
-                    })
-                }
-            },
-            "trim_suggestions": {
-                "id": "call_trim_suggestions", 
-                "type": "function",
-                "function": {
-                    "name": "trim_suggestions",
-                    "arguments": json.dumps({
-                        "current_amount": 400.0,
-                        "target_reduction": 50.0
-                    })
-                }
-            }
-        }
-        
-        return tool_calls.get(rule_name)
+        return _TOOL_CALL_TEMPLATES.get(rule_name)
 
-class OpenAICompatible(AIProvider):
+class OpenAICompatible:
     """OpenAI-compatible provider for Qwen and other models."""
     
     def __init__(self):
-        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.model = os.getenv("QWEN_MODEL", "qwen2.5-7b-instruct")
+        self.base_url = OPENAI_BASE_URL
+        self.api_key = OPENAI_API_KEY
+        self.model = QWEN_MODEL
         
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
-    
-    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
-        """Generate chat completion using OpenAI-compatible API."""
-        headers = {
+        
+        # The HTTP stack is only imported when a real provider is configured,
+        # so the default mock path never loads requests/urllib3
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self._requests = requests
+        
+        # One pooled session per provider: calls reuse a keep-alive connection
+        # instead of paying the TCP and TLS handshake every time. POST is not
+        # retried by default, so allow it for the transient upstream statuses.
+        self._session = requests.Session()
+        self._session.headers.update({
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
-        }
-        
+        })
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=frozenset({"POST"}),
+                raise_on_status=False
+            )
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+    
+    def _request_body(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]]) -> Dict[str, Any]:
         data = {
             "model": self.model,
             "messages": messages,
@@ -190,31 +362,167 @@ class OpenAICompatible(AIProvider):
         if tools:
             data["tools"] = tools
             data["tool_choice"] = "auto"
+        return data
+    
+    @staticmethod
+    def _error_response(e: Exception) -> Dict[str, Any]:
+        # Fallback to mock response
+        return {
+            "choices": [{
+                "message": {
+                    "role": "assistant",
+                    "content": f"I'm currently experiencing technical difficulties. Please try again later. (Error: {str(e)})"
+                }
+            }]
+        }
+    
+    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, stream: bool = False) -> Dict[str, Any]:
+        """Generate chat completion using OpenAI-compatible API.
+        
+        With stream=True the reply is read as server-sent events and
+        assembled into the same shape; reading stops as soon as the model
+        finishes, e.g. once its tool calls are complete.
+        """
+        key = _cache_key(self, messages, tools, stream)
+        if key is not None:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        try:
+            if stream:
+                result = self._collect_stream(messages, tools)
+            else:
+                response = self._session.post(
+                    f"{self.base_url}/chat/completions",
+                    json=self._request_body(messages, tools),
+                    timeout=30
+                )
+                response.raise_for_status()
+                result = _json_loads(response.content)
+        
+        except (self._requests.exceptions.RequestException, ValueError) as e:
+            # Failures fall back to a canned reply and are never cached
+            return self._error_response(e)
+        
+        if key is not None:
+            _response_cache.put(key, result)
+        return result
+    
+    def iter_chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield streamed completion chunks as they arrive."""
+        data = self._request_body(messages, tools)
+        data["stream"] = True
+        
+        with self._session.post(
+            f"{self.base_url}/chat/completions",
+            json=data,
+            timeout=30,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]":
+                    break
+                yield _json_loads(payload)
+    
+    def _collect_stream(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]]) -> Dict[str, Any]:
+        """Fold streamed deltas into a non-streaming response dict."""
+        content = []
+        tool_calls = {}
+        finish_reason = None
+        
+        for chunk in self.iter_chat_completion(messages, tools):
+            if not chunk.get("choices"):
+                continue
+            choice = chunk["choices"][0]
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                content.append(delta["content"])
+            for call_delta in delta.get("tool_calls") or []:
+                call = tool_calls.setdefault(call_delta.get("index", 0), {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                if call_delta.get("id"):
+                    call["id"] = call_delta["id"]
+                function = call_delta.get("function") or {}
+                call["function"]["name"] += function.get("name") or ""
+                call["function"]["arguments"] += function.get("arguments") or ""
+            finish_reason = choice.get("finish_reason")
+            if finish_reason:
+                break
+        
+        message = {
+            "role": "assistant",
+            "content": "".join(content) if content else None
+        }
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        
+        return {
+            "choices": [{
+                "message": message,
+                "finish_reason": finish_reason
+            }]
+        }
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Generate chat completion without blocking the event loop."""
+        import httpx
+        
+        key = _cache_key(self, messages, tools)
+        if key is not None:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                return cached
         
         try:
-            response = requests.post(
+            response = await _get_async_client().post(
                 f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json=self._request_body(messages, tools)
             )
             response.raise_for_status()
-            return response.json()
+            result = _json_loads(response.content)
         
-        except requests.exceptions.RequestException as e:
-            # Fallback to mock response
-            return {
-                "choices": [{
-                    "message": {
-                        "role": "assistant",
-                        "content": f"I'm currently experiencing technical difficulties. Please try again later. (Error: {str(e)})"
-                    }
-                }]
-            }
+        except (httpx.HTTPError, ValueError) as e:
+            return self._error_response(e)
+        
+        if key is not None:
+            _response_cache.put(key, result)
+        return result
 
+# Pooled clients for async callers, one per event loop: a client's
+# connections belong to the loop they were opened on. Created on first use
+# so the synchronous path never imports httpx.
+_async_clients = {}
+_async_clients_lock = threading.Lock()
+
+def _get_async_client():
+    import asyncio
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            import httpx
+            # Clients of loops that have since closed can never be used again
+            for closed in [l for l in _async_clients if l.is_closed()]:
+                del _async_clients[closed]
+            client = _async_clients[loop] = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            )
+    return client
+
+@functools.lru_cache(maxsize=1)
 def get_ai_provider() -> AIProvider:
-    """Get the configured AI provider instance."""
-    if os.getenv("USE_MOCK_AI", "true").lower() == "true":
+    """Get the configured AI provider instance (built once per process)."""
+    if USE_MOCK_AI:
         return MockCoach()
     else:
         try:
@@ -224,66 +532,98 @@ def get_ai_provider() -> AIProvider:
             return MockCoach()
 
 # PII Redaction utilities
+_match_group_name = operator.attrgetter("lastgroup")
+
+def _splice_tokens(text: str, matches: Iterable[re.Match], kind_of, token_map: Dict[str, str]) -> str:
+    """Swap each match for a numbered <KIND_TOKEN_i>, building the result in one pass."""
+    out = []
+    counters = {}
+    last = 0
+    for match in matches:
+        kind = kind_of(match)
+        index = counters.get(kind, 0)
+        counters[kind] = index + 1
+        token = f"<{kind}_TOKEN_{index}>"
+        token_map[token] = match.group(0)
+        out.append(text[last:match.start()])
+        out.append(token)
+        last = match.end()
+    if not out:
+        return text
+    out.append(text[last:])
+    return "".join(out)
+
+@functools.lru_cache(maxsize=128)
+def _literal_re(terms: tuple) -> re.Pattern:
+    """Alternation of literal terms, longest first so overlaps take the longer one."""
+    return re.compile("|".join(map(re.escape, sorted(terms, key=len, reverse=True))))
+
 def redact_pii(text: str, user_data: Dict[str, Any]) -> tuple[str, Dict[str, str]]:
     """
     Redact PII from text before sending to AI.
     Returns (redacted_text, token_map) where token_map can restore original values.
     """
     token_map = {}
-    redacted_text = text
     
-    # Redact phone numbers
-    phone_pattern = r'\+?\d{10,15}'
-    phones = re.findall(phone_pattern, text)
-    for i, phone in enumerate(phones):
-        token = f"<PHONE_TOKEN_{i}>"
-        token_map[token] = phone
-        redacted_text = redacted_text.replace(phone, token)
+    # Redact phone numbers and UPI IDs in one scan
+    redacted_text = _splice_tokens(text, _PII_RE.finditer(text), _match_group_name, token_map)
     
     # Redact names (if provided in user_data)
-    if user_data.get('name'):
-        name = user_data['name']
-        token = "<NAME_TOKEN>"
-        token_map[token] = name
-        redacted_text = redacted_text.replace(name, token)
-    
-    # Redact UPI IDs
-    upi_pattern = r'[\w\.-]+@[\w\.-]+'
-    upis = re.findall(upi_pattern, text)
-    for i, upi in enumerate(upis):
-        token = f"<UPI_TOKEN_{i}>"
-        token_map[token] = upi
-        redacted_text = redacted_text.replace(upi, token)
+    name = user_data.get('name')
+    sensitive_terms = user_data.get('sensitive_terms')
+    if isinstance(name, str) and not sensitive_terms:
+        if name:
+            token = "<NAME_TOKEN>"
+            token_map[token] = name
+            redacted_text = redacted_text.replace(name, token)
+    elif name or sensitive_terms:
+        # Several names/aliases or other literals: one pass over the text
+        # finds them all, longest first, each occurrence getting its own token
+        names = [name] if isinstance(name, str) else list(name or ())
+        kinds = {term: "TERM" for term in sensitive_terms or () if term}
+        kinds.update((n, "NAME") for n in names if n)
+        if kinds:
+            redacted_text = _splice_tokens(
+                redacted_text,
+                _literal_re(tuple(sorted(kinds))).finditer(redacted_text),
+                lambda match: kinds[match.group(0)],
+                token_map
+            )
     
     return redacted_text, token_map
 
 def restore_pii(text: str, token_map: Dict[str, str]) -> str:
     """Restore PII from redacted text using token map."""
-    restored_text = text
-    for token, original_value in token_map.items():
-        restored_text = restored_text.replace(token, original_value)
-    return restored_text
+    if not token_map:
+        return text
+    # One pass over the text for all tokens instead of one replace per token
+    token_re = re.compile("|".join(map(re.escape, token_map)))
+    return token_re.sub(lambda match: token_map[match.group(0)], text)
 
-def validate_tool_calls(tool_calls: List[Dict], allowed_tools: List[str]) -> List[Dict]:
+def validate_tool_calls(tool_calls: List[Dict], allowed_tools: Iterable[str]) -> List[Dict]:
     """Validate and filter tool calls to ensure only allowed tools are called."""
+    allowed = allowed_tools if isinstance(allowed_tools, frozenset) else frozenset(allowed_tools)
     validated_calls = []
     
     for call in tool_calls:
-        if call.get("function", {}).get("name") in allowed_tools:
-            # Additional validation: ensure no direct fund transfers
-            function_name = call["function"]["name"]
-            arguments = call["function"].get("arguments", {})
-            
-            if isinstance(arguments, str):
-                try:
-                    arguments = json.loads(arguments)
-                except json.JSONDecodeError:
-                    continue
-            
-            # Reject any tool calls that attempt direct fund movement outside allowed tools
-            if "transfer" in function_name.lower() or "send" in function_name.lower():
+        function = call.get("function") or {}
+        function_name = function.get("name")
+        if function_name not in allowed:
+            continue
+        
+        # Reject any tool calls that attempt direct fund movement outside allowed tools
+        if _DENY_TOOL_RE.search(function_name):
+            continue
+        
+        # Arguments are not inspected, but malformed JSON still rejects the
+        # call; parse last so cheaper rejections skip it
+        arguments = function.get("arguments")
+        if isinstance(arguments, str):
+            try:
+                _json_loads(arguments)
+            except json.JSONDecodeError:
                 continue
-                
-            validated_calls.append(call)
+        
+        validated_calls.append(call)
     
     return validated_calls
\ No newline at end of file
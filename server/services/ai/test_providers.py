@@ -0,0 +1,146 @@
+import json
+from providers import OpenAICompatible, redact_pii, restore_pii
+
+def make_provider(chunks):
+    """OpenAICompatible that streams the given chunks without any HTTP"""
+    provider = object.__new__(OpenAICompatible)
+    provider.iter_chat_completion = lambda messages, tools=None: iter(chunks)
+    return provider
+
+def chunk(delta, finish_reason=None):
+    return {"choices": [{"delta": delta, "finish_reason": finish_reason}]}
+
+class FakeStreamResponse:
+    """Context-managed response yielding raw SSE lines"""
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+class FakeSession:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def post(self, url, **kwargs):
+        assert kwargs["json"]["stream"] is True
+        return FakeStreamResponse(self.lines)
+
+class TestStreamAssembly:
+    """Test folding streamed deltas into one response"""
+
+    def test_tool_call_arguments_are_joined_across_chunks(self):
+        """Test that tool call fragments are stitched together per index"""
+        provider = make_provider([
+            chunk({"role": "assistant"}),
+            chunk({"tool_calls": [{"index": 0, "id": "call_a", "function": {"name": "create_plan", "arguments": ""}}]}),
+            chunk({"tool_calls": [{"index": 0, "function": {"arguments": "{\"cap_per"}}]}),
+            chunk({"tool_calls": [{"index": 1, "id": "call_b", "function": {"name": "mint_", "arguments": "{}"}}]}),
+            chunk({"tool_calls": [{"index": 1, "function": {"name": "vouchers"}}]}),
+            chunk({"tool_calls": [{"index": 0, "function": {"arguments": "_head\": 300}"}}]}),
+            chunk({}, finish_reason="tool_calls"),
+        ])
+
+        result = provider._collect_stream([], None)
+        choice = result["choices"][0]
+        calls = choice["message"]["tool_calls"]
+
+        assert choice["finish_reason"] == "tool_calls"
+        assert choice["message"]["content"] is None
+        assert [call["id"] for call in calls] == ["call_a", "call_b"]
+        assert calls[0]["function"]["name"] == "create_plan"
+        assert json.loads(calls[0]["function"]["arguments"]) == {"cap_per_head": 300}
+        assert calls[1]["function"] == {"name": "mint_vouchers", "arguments": "{}"}
+
+    def test_reading_stops_at_finish_reason(self):
+        """Test that chunks after the finishing one are never read"""
+        def chunks():
+            yield chunk({"content": "Hel"})
+            yield chunk({"content": "lo"}, finish_reason="stop")
+            raise AssertionError("read past finish_reason")
+
+        result = make_provider(chunks())._collect_stream([], None)
+        assert result["choices"][0]["message"] == {"role": "assistant", "content": "Hello"}
+        assert result["choices"][0]["finish_reason"] == "stop"
+
+    def test_stream_without_finish_reason_keeps_content(self):
+        """Test that a stream ending early still returns what arrived"""
+        provider = make_provider([
+            {"choices": []},
+            chunk({"content": "partial"}),
+        ])
+
+        result = provider._collect_stream([], None)
+        assert result["choices"][0]["message"]["content"] == "partial"
+        assert result["choices"][0]["finish_reason"] is None
+
+    def test_sse_lines_are_parsed_until_done(self):
+        """Test that only data lines are decoded and [DONE] ends the stream"""
+        provider = object.__new__(OpenAICompatible)
+        provider.base_url = "http://ai.test"
+        provider.model = "test-model"
+        provider._session = FakeSession([
+            b": keep-alive",
+            b"",
+            b"data: " + json.dumps(chunk({"content": "a"})).encode(),
+            b"data:" + json.dumps(chunk({"content": "b"})).encode(),
+            b"data: [DONE]",
+            b"data: " + json.dumps(chunk({"content": "never"})).encode(),
+        ])
+
+        chunks = list(provider.iter_chat_completion([{"role": "user", "content": "hi"}]))
+        assert [c["choices"][0]["delta"]["content"] for c in chunks] == ["a", "b"]
+
+class TestPIIRedaction:
+    """Test PII redaction and restoration"""
+
+    def test_repeated_values_get_their_own_tokens(self):
+        """Test that every occurrence is tokenised and restored in place"""
+        text = "Pay +919876543210 via john@upi, then +919876543210 again via john@upi"
+
+        redacted, token_map = redact_pii(text, {})
+
+        assert "9876543210" not in redacted and "john@upi" not in redacted
+        assert redacted == (
+            "Pay <PHONE_TOKEN_0> via <UPI_TOKEN_0>, then <PHONE_TOKEN_1> again via <UPI_TOKEN_1>"
+        )
+        assert restore_pii(redacted, token_map) == text
+
+    def test_overlapping_names_prefer_the_longest(self):
+        """Test that a name containing another is redacted as a whole"""
+        text = "John Doe paid John, and Doe paid John Doe +919876543210"
+        user_data = {"name": ["John", "John Doe"], "sensitive_terms": ["Doe"]}
+
+        redacted, token_map = redact_pii(text, user_data)
+
+        assert "John" not in redacted and "Doe" not in redacted
+        assert token_map["<NAME_TOKEN_0>"] == "John Doe"
+        assert token_map["<NAME_TOKEN_1>"] == "John"
+        assert token_map["<TERM_TOKEN_0>"] == "Doe"
+        assert restore_pii(redacted, token_map) == text
+
+    def test_single_name_round_trip(self):
+        """Test that a repeated single name restores everywhere"""
+        text = "Hi John Doe, John Doe's plan is ready"
+
+        redacted, token_map = redact_pii(text, {"name": "John Doe"})
+
+        assert redacted == "Hi <NAME_TOKEN>, <NAME_TOKEN>'s plan is ready"
+        assert restore_pii(redacted, token_map) == text
+
+    def test_text_without_pii_is_unchanged(self):
+        """Test that text without PII passes through unchanged"""
+        redacted, token_map = redact_pii("Plan dinner for four", {"name": "John"})
+
+        assert redacted == "Plan dinner for four"
+        assert restore_pii(redacted, token_map) == "Plan dinner for four"